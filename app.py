@@ -1,21 +1,64 @@
-from flask import Flask, request, jsonify
-import pandas as pd
+from flask import Flask, Response, request, jsonify
 import logging
 import asyncio
+import atexit
+import concurrent.futures
+import json
+import queue
+import signal
+import sys
+import threading
+import time
 from playwright_helpers import close_popup, human_like_actions, input_card_number_and_check, click_check_another_card
 from playwright_init import init_driver
-from card_processing import process_card_batches
+from card_processing import process_cards_by_region
+from page_pool import RegionPools
+from balance_cache import BalanceCache
+from jobs import JobRunner, JobStore
+from metrics import render_metrics
+from runtime import AsyncRuntime
+from governor import GOVERNOR
+import pacing
+from log_config import setup_logging
+from sharding import ShardCoordinator
+from validation import CheckPlan, validate_card_items
+from settings import JOB_MAX_CARDS, REQUEST_TIMEOUT_S, SHARD_PAGES, SHARD_PROCESSES, STREAM_MAX_ITEMS
 
 app = Flask(__name__)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler("../log/api_requests.log"), logging.StreamHandler()],
-)
+setup_logging("api_requests")
 
 MAX_THREADS = 3  # 增加并发线程数
 
+# 页面池里的 Playwright 对象绑定在同一个事件循环上，所以整个进程共用一个后台循环
+runtime = AsyncRuntime().start()
+atexit.register(runtime.stop)
+
+balance_cache = BalanceCache()
+job_store = JobStore()
+job_runner = JobRunner(job_store, cache=balance_cache)
+
+page_pools = None
+page_pool_lock = threading.Lock()
+
+def get_page_pools():
+    """每个地区一个页面池；LULU_WARM_REGIONS 里的地区在这里预热，其他地区第一次有卡时启动。"""
+    global page_pools
+    with page_pool_lock:
+        if page_pools is None:
+            pools = RegionPools()
+            runtime.run(pools.start())
+            runtime.add_shutdown_hook(pools.close)
+            page_pools = pools
+            if SHARD_PROCESSES > 0:
+                # 分片 worker 只服务默认地区，其他地区的卡仍在本进程的页面池里查询
+                shards = ShardCoordinator(SHARD_PROCESSES, SHARD_PAGES).start()
+                runtime.add_shutdown_hook(lambda: asyncio.get_running_loop().run_in_executor(None, shards.stop))
+                job_runner.shards = shards
+            # 页面池就绪后再启动任务执行器，重启前没跑完的任务会自动继续
+            runtime.submit(job_runner.run_forever(pools))
+    return page_pools
+
 @app.route('/hello')
 def hello_world():
     return 'Hello, World!'
@@ -29,46 +72,175 @@ def check_gift_card_values():
     if len(input_data) > MAX_THREADS:
         return jsonify({"error": "Query cannot exceed 3 items per request."}), 200
 
-    for item in input_data:
-        if not all(key in item for key in ["card_type", "card_number", "card_issue_country", "calling_time"]):
-            return jsonify({"error": "Each object must contain 'card_type', 'card_number', 'card_issue_country', and 'calling_time' fields."}), 200
-
-    print("==== input_data ====")
-    print(input_data)
-
-    df = pd.DataFrame(input_data)
-    lulu_cards = df[df['card_type'] == 'Lululemon-GC']
-    print("==== luluCards ====")
-    print(lulu_cards)
-
-    lulu_gc_numbers = lulu_cards['card_number'].tolist()
-    print("==== card_numbers ====")
-    print(lulu_gc_numbers)
-
-    logging.info(f"Total Lululemon cards to check: {len(lulu_gc_numbers)}")
-
-    # 等待异步任务的结果
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    final_results = loop.run_until_complete(process_card_batches(lulu_gc_numbers, len(lulu_gc_numbers)))
-    
-    if isinstance(final_results, list):
-        print("======原始数据=======")
-        print(input_data)
-        print("========最终结果========")
-        print(final_results)
-    else:
-        print("========错误: process_card_batches 没有返回列表========")
-        return jsonify({"error": "Internal processing error"}), 500
-    
-    for original, result in zip(input_data, final_results):
-        original["is_call_success"] = True if result.get("balance") is not None else False
-        original["balance"] = result.get("balance")
-        original["balance_timestamp"] = result.get("timestamp")
-        original["time_used_by_s"] = result.get("timestamp", 0) - original["calling_time"]
-    
+    error = validate_card_items(input_data)
+    if error:
+        return jsonify({"error": error}), 200
+
+    # 非 Lululemon 的卡和格式不对的卡直接给结果，重复的卡只查一次
+    plan = CheckPlan(input_data)
+    outputs = [None] * len(input_data)
+    for index, output in plan.immediate_results():
+        outputs[index] = output
+    logging.info(
+        f"Total Lululemon cards to check: {len(plan.card_numbers)} "
+        f"({len(plan.rejected)} malformed, {plan.pending_count - len(plan.card_numbers)} duplicates)"
+    )
+
+    if plan.card_numbers:
+        # max_age（秒）可以按请求收紧缓存有效期，max_age=0 表示强制重新查询
+        max_age = request.args.get("max_age", type=int)
+        pools = get_page_pools()
+        try:
+            final_results = runtime.run(
+                process_cards_by_region(
+                    plan.card_numbers, plan.countries, pools, cache=balance_cache, max_age=max_age
+                ),
+                timeout=REQUEST_TIMEOUT_S,
+            )
+        except concurrent.futures.TimeoutError:
+            logging.error(f"Request timed out after {REQUEST_TIMEOUT_S}s")
+            return jsonify({"error": "Request timed out"}), 504
+        for position, result in enumerate(final_results):
+            for index, output in plan.expand(position, result):
+                outputs[index] = output
+
+    # time_used_by_s 依赖调用方的时钟，只保留给旧的调用方；服务端耗时看 timings_ms（单调时钟）
+    now = int(time.time())
+    for output in outputs:
+        finished_at = output["balance_timestamp"] if output["balance_timestamp"] and not output["from_cache"] else now
+        output["time_used_by_s"] = finished_at - output["calling_time"]
+
     logging.info("All batch tasks completed")
-    return jsonify({"results": input_data})
+    return jsonify({"results": outputs})
+
+def format_stream_event(event, use_sse):
+    data = json.dumps(event, ensure_ascii=False)
+    return f"data: {data}\n\n" if use_sse else data + "\n"
+
+@app.route('/check_lululemon_gift_card_values/stream', methods=['POST'])
+def stream_gift_card_values():
+    """每张卡一查完就立即输出一行 NDJSON（或一条 SSE 事件），带上原始输入的 index。"""
+    input_data = request.get_json(silent=True)
+    error = validate_card_items(input_data)
+    if error:
+        return jsonify({"error": error}), 400
+    if len(input_data) > STREAM_MAX_ITEMS:
+        return jsonify({"error": f"Query cannot exceed {STREAM_MAX_ITEMS} items per request."}), 400
+
+    use_sse = request.args.get("format") == "sse" or request.accept_mimetypes.best == "text/event-stream"
+    max_age = request.args.get("max_age", type=int)
+
+    plan = CheckPlan(input_data)
+    events = queue.Queue()
+
+    def on_result(position, result):
+        for index, output in plan.expand(position, result):
+            events.put(dict(output, index=index))
+
+    future = None
+    if plan.card_numbers:
+        pools = get_page_pools()
+        future = runtime.submit(
+            process_cards_by_region(
+                plan.card_numbers,
+                plan.countries,
+                pools,
+                cache=balance_cache,
+                max_age=max_age,
+                on_result=on_result,
+            )
+        )
+
+    def generate():
+        try:
+            for index, output in plan.immediate_results():
+                yield format_stream_event(dict(output, index=index), use_sse)
+            deadline = time.monotonic() + REQUEST_TIMEOUT_S
+            remaining = plan.pending_count
+            while remaining:
+                try:
+                    event = events.get(timeout=1.0)
+                except queue.Empty:
+                    # 运行时关闭等情况下 future 会被取消，这时调 exception() 会抛 CancelledError
+                    if future.cancelled():
+                        logging.error("Stream processing was cancelled")
+                        yield format_stream_event({"error": "Request cancelled"}, use_sse)
+                        return
+                    if future.done() and future.exception() is not None:
+                        logging.error(f"Stream processing failed: {future.exception()}")
+                        yield format_stream_event({"error": "Internal processing error"}, use_sse)
+                        return
+                    if time.monotonic() > deadline:
+                        logging.error(f"Stream timed out after {REQUEST_TIMEOUT_S}s")
+                        yield format_stream_event({"error": "Request timed out"}, use_sse)
+                        return
+                    continue
+                remaining -= 1
+                yield format_stream_event(event, use_sse)
+        finally:
+            # 客户端提前断开时取消剩余的查询
+            if future is not None and not future.done():
+                future.cancel()
+
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    return Response(generate(), mimetype=mimetype, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    input_data = request.get_json(silent=True)
+    error = validate_card_items(input_data)
+    if error:
+        return jsonify({"error": error}), 400
+    if not input_data:
+        return jsonify({"error": "Job must contain at least one item."}), 400
+    if len(input_data) > JOB_MAX_CARDS:
+        return jsonify({"error": f"Job cannot exceed {JOB_MAX_CARDS} items."}), 400
+
+    job_id = job_store.create(input_data)
+    logging.info(f"Job {job_id} queued with {len(input_data)} items")
+    get_page_pools()
+    job_runner.notify()
+    return jsonify({"job_id": job_id, "status": "queued", "total": len(input_data)}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    if not job_runner.cancel(job_id):
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify({"job_id": job_id, "status": job_store.status(job_id)})
+
+@app.route('/pool/stats')
+def pool_stats():
+    if page_pools is None:
+        return jsonify({"error": "Page pool is not started."}), 503
+    stats = {
+        "regions": page_pools.stats(),
+        "browser": page_pools.browser_stats(),
+        "concurrency": GOVERNOR.stats(),
+        "pacing": pacing.active_profile().as_dict(),
+    }
+    if job_runner.shards is not None:
+        # 多进程模式下每个 worker 进程的吞吐量，用来挑选 LULU_SHARD_PROCESSES
+        stats["shards"] = job_runner.shards.stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(balance_cache.stats())
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # pm2 停止/重启时发送 SIGTERM，转成正常退出以便 atexit 关闭浏览器
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # 启动时预热页面池；关闭 reloader，避免父进程也启动一组浏览器
+    get_page_pools()
+    app.run(debug=True, use_reloader=False)
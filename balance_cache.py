@@ -0,0 +1,133 @@
+import hashlib
+import hmac
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from settings import CACHE_MAX_ENTRIES, CACHE_PURGE_INTERVAL_S, CACHE_SALT, CACHE_SQLITE_PATH, CACHE_TTL_S
+from sqlite_writer import SqliteWriter
+
+
+class BalanceCache:
+    """两级余额缓存：进程内的 LRU，加上可选的 SQLite 存储。
+
+    不保存卡号本身，键是地区代码加卡号的 HMAC-SHA256（密钥是 salt）；同一个卡号在不同地区是
+    不同的卡，余额和币种都不一样，所以按地区分开缓存。只缓存查到的余额，查询失败不缓存。
+    """
+
+    def __init__(
+        self,
+        ttl_s=CACHE_TTL_S,
+        max_entries=CACHE_MAX_ENTRIES,
+        sqlite_path=CACHE_SQLITE_PATH,
+        salt=CACHE_SALT,
+        purge_interval_s=CACHE_PURGE_INTERVAL_S,
+    ):
+        self.ttl_s = ttl_s
+        self.purge_interval_s = purge_interval_s
+        self._next_purge = 0.0
+        self.max_entries = max_entries
+        if salt is None:
+            salt = os.urandom(32).hex()
+            if sqlite_path:
+                logging.warning("LULU_CACHE_SALT is not set, on-disk cache entries will not survive a restart")
+        self._salt = salt.encode()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._writer = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            # WAL：写线程提交时读不会被挡住
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS balances ("
+                "key TEXT PRIMARY KEY, balance TEXT NOT NULL, timestamp REAL NOT NULL)"
+            )
+            self._db.commit()
+            # 写入交给单独的写线程批量提交，set 在事件循环上只更新内存
+            self._writer = SqliteWriter(sqlite_path, name="cache-writer")
+        self.hits = {"memory": 0, "sqlite": 0}
+        self.misses = 0
+        self.expired = 0
+
+    def key(self, card_number, region=None):
+        message = card_number if region is None else f"{region}:{card_number}"
+        return hmac.new(self._salt, message.encode(), hashlib.sha256).hexdigest()
+
+    def get(self, card_number, max_age=None, region=None):
+        """返回 {"balance", "timestamp"}，没有命中或已过期时返回 None。"""
+        max_age = self.ttl_s if max_age is None else min(max_age, self.ttl_s)
+        if max_age <= 0:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        key = self.key(card_number, region)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry["timestamp"] <= max_age:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return dict(entry)
+
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT balance, timestamp FROM balances WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = {"balance": row[0], "timestamp": row[1]}
+                    self._remember(key, entry)
+                    if now - entry["timestamp"] <= max_age:
+                        self.hits["sqlite"] += 1
+                        return dict(entry)
+
+            if entry is not None:
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def set(self, card_number, balance, timestamp=None, region=None):
+        entry = {"balance": balance, "timestamp": time.time() if timestamp is None else timestamp}
+        key = self.key(card_number, region)
+        with self._lock:
+            self._remember(key, entry)
+        if self._writer is not None:
+            self._writer.execute(
+                "INSERT OR REPLACE INTO balances (key, balance, timestamp) VALUES (?, ?, ?)",
+                (key, entry["balance"], entry["timestamp"]),
+            )
+            self._purge_expired()
+
+    def _purge_expired(self):
+        """每隔 purge_interval_s 通过写线程删一次过期的行，落盘缓存不会无限增长。"""
+        now = time.time()
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval_s
+        self._writer.execute("DELETE FROM balances WHERE timestamp < ?", (now - self.ttl_s,))
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+                "sqlite": self._db is not None,
+            }
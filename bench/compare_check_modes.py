@@ -0,0 +1,94 @@
+"""对比 dom、response、inpage 三种查询方式的单卡耗时。
+
+    python -m bench.compare_check_modes --cards files/data.csv --limit 20
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import time
+
+import pacing
+from bench.stats import summarize_latencies
+from playwright_helpers import (
+    BALANCE_FOUND,
+    click_check_another_card,
+    close_popup,
+    input_card_number_and_check,
+    open_check_dialogue,
+)
+from log_config import setup_logging
+from playwright_init import init_driver
+from settings import GIFT_CARD_URL, HEADLESS
+
+
+def load_cards(path, limit):
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        cards = [row[0].strip() for row in reader if row and row[0].strip()]
+    return cards[:limit] if limit else cards
+
+
+async def run_mode(mode, cards, url, headless):
+    playwright, browser, context, page = await init_driver(headless=headless)
+    check_ms, reset_ms, errors = [], [], 0
+    try:
+        await page.goto(url)
+        await close_popup(page)
+        await open_check_dialogue(page)
+        for card_number in cards:
+            started = time.perf_counter()
+            check = await input_card_number_and_check(page, card_number, mode=mode)
+            checked = time.perf_counter()
+            check_ms.append(round((checked - started) * 1000, 1))
+            if check["outcome"] != BALANCE_FOUND:
+                errors += 1
+                continue
+            if check["reset"]:
+                # inpage 模式已经在页面里复位，用页面里测得的耗时
+                reset_ms.append(check["timings"]["reset_ms"])
+                continue
+            await click_check_another_card(page)
+            reset_ms.append(round((time.perf_counter() - checked) * 1000, 1))
+    finally:
+        await browser.close()
+        await playwright.stop()
+    return {
+        "mode": mode,
+        "errors": errors,
+        "check": summarize_latencies(check_ms),
+        "reset": summarize_latencies(reset_ms),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", default="files/data.csv")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--url", default=GIFT_CARD_URL)
+    parser.add_argument("--modes", default="dom,response,inpage")
+    parser.add_argument("--headless", action="store_true", default=HEADLESS)
+    parser.add_argument("--pacing", default="zero", help="节奏策略（pacing.py），默认 zero 不加任何等待")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+    setup_logging("bench")
+
+    # 节奏等待对各种模式是一样的噪声，默认去掉
+    pacing.set_profile(args.pacing)
+
+    cards = load_cards(args.cards, args.limit)
+    report = {"url": args.url, "cards": len(cards), "pacing": args.pacing, "modes": []}
+    for mode in args.modes.split(","):
+        logging.info(f"Benchmarking check mode '{mode}' on {len(cards)} cards")
+        report["modes"].append(await run_mode(mode, cards, args.url, args.headless))
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,219 @@
+"""本地模拟的礼品卡查询页面，复现 playwright_helpers 依赖的 DOM 结构。
+
+    python -m bench.mock_site --port 8765 --latency-ms 300 --jitter-ms 100
+
+页面结构：
+- #countrySelectorModal，关闭按钮在 div/div/div[1]/button
+- /html/body/div[1]/div[3]/div[2]/a 打开查询对话框
+- #card-number 输入框和 button[value=check-balance]
+- 查询后显示 p.balance 和 "CHECK ANOTHER CARD" 按钮
+余额接口是 POST /api/giftcard/balance，返回 JSON。
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+GIFT_CARD_PATH = "/en-au/content/gift-cards/gift-cards.html"
+BALANCE_API_PATH = "/api/giftcard/balance"
+
+PAGE_HTML = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Gift Cards (mock)</title></head>
+<body>
+<div id="app">
+  <div class="header">Mock gift card site</div>
+  <div class="nav">Navigation</div>
+  <div class="gift-card-actions">
+    <div class="buy"><a href="#buy">Buy a gift card</a></div>
+    <div class="check"><a href="#check" id="open-check">Check your balance</a></div>
+  </div>
+  <div id="check-dialog" style="display:none">
+    <form id="check-form" onsubmit="return false">
+      <input id="card-number" name="card-number" type="text" autocomplete="off">
+      <button type="submit" value="check-balance">Check balance</button>
+    </form>
+    <div id="check-result" style="display:none">
+      <p class="balance"></p>
+      <button type="button" id="check-another">CHECK ANOTHER CARD</button>
+    </div>
+    <p class="error" style="display:none"></p>
+  </div>
+</div>
+<div id="countrySelectorModal" aria-hidden="false" style="display:block">
+  <div><div>
+    <div class="modal-header"><button type="button" id="close-country-selector">Close</button></div>
+    <div class="modal-body">Choose your country</div>
+  </div></div>
+</div>
+<script>
+  const modal = document.getElementById("countrySelectorModal");
+  const dialog = document.getElementById("check-dialog");
+  const form = document.getElementById("check-form");
+  const result = document.getElementById("check-result");
+  const balance = result.querySelector("p.balance");
+  const error = dialog.querySelector("p.error");
+
+  document.getElementById("close-country-selector").addEventListener("click", () => {
+    modal.setAttribute("aria-hidden", "true");
+    modal.style.display = "none";
+    document.cookie = "countrySelected=au; path=/";
+  });
+  document.getElementById("open-check").addEventListener("click", (event) => {
+    event.preventDefault();
+    dialog.style.display = "block";
+  });
+  form.querySelector("button[value=check-balance]").addEventListener("click", async () => {
+    error.style.display = "none";
+    const response = await fetch("%(balance_api)s", {
+      method: "POST",
+      headers: {"Content-Type": "application/json"},
+      body: JSON.stringify({cardNumber: document.getElementById("card-number").value}),
+    });
+    const payload = await response.json();
+    if (response.ok) {
+      balance.textContent = payload.formattedBalance;
+      form.style.display = "none";
+      result.style.display = "block";
+    } else {
+      error.textContent = payload.error;
+      error.style.display = "block";
+    }
+  });
+  document.getElementById("check-another").addEventListener("click", () => {
+    result.style.display = "none";
+    balance.textContent = "";
+    document.getElementById("card-number").value = "";
+    form.style.display = "block";
+  });
+  if (document.cookie.includes("countrySelected=")) {
+    modal.setAttribute("aria-hidden", "true");
+    modal.style.display = "none";
+  }
+</script>
+</body>
+</html>
+""" % {"balance_api": BALANCE_API_PATH}
+
+
+def mock_balance(card_number):
+    """卡号决定余额，方便核对结果。"""
+    cents = int(hashlib.sha256(card_number.encode()).hexdigest(), 16) % 50000
+    return cents / 100
+
+
+class MockSiteHandler(BaseHTTPRequestHandler):
+    server_version = "MockGiftCardSite/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _delay(self, base_ms):
+        jitter = self.server.jitter_ms
+        delay_ms = base_ms + (random.uniform(-jitter, jitter) if jitter else 0)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def _send(self, status, content_type, body):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/favicon.ico":
+            self._send(404, "text/plain", "")
+            return
+        self._delay(self.server.page_latency_ms)
+        self._send(200, "text/html; charset=utf-8", PAGE_HTML)
+
+    def do_POST(self):
+        if self.path.split("?")[0] != BALANCE_API_PATH:
+            self._send(404, "application/json", json.dumps({"error": "Not found"}))
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            card_number = str(json.loads(self.rfile.read(length) or b"{}").get("cardNumber", "")).strip()
+        except ValueError:
+            card_number = ""
+        self._delay(self.server.latency_ms)
+        with self.server.lock:
+            self.server.balance_requests += 1
+
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self._send(503, "application/json", json.dumps({"error": "Service temporarily unavailable"}))
+        elif not card_number.isdigit() or not 16 <= len(card_number) <= 21:
+            self._send(400, "application/json", json.dumps({"error": "Invalid card number"}))
+        else:
+            balance = mock_balance(card_number)
+            self._send(200, "application/json", json.dumps({
+                "cardNumber": card_number[-4:],
+                "balance": balance,
+                "formattedBalance": f"A${balance:,.2f}",
+            }))
+
+
+class MockSite:
+    """在后台线程里运行的模拟站点，可作为 with 语句使用。"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=300, jitter_ms=0, page_latency_ms=0, error_rate=0.0):
+        self.server = ThreadingHTTPServer((host, port), MockSiteHandler)
+        self.server.daemon_threads = True
+        self.server.latency_ms = latency_ms
+        self.server.jitter_ms = jitter_ms
+        self.server.page_latency_ms = page_latency_ms
+        self.server.error_rate = error_rate
+        self.server.balance_requests = 0
+        self.server.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{GIFT_CARD_PATH}"
+
+    @property
+    def balance_requests(self):
+        return self.server.balance_requests
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-site", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300, help="余额接口的延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--page-latency-ms", type=float, default=0, help="页面加载的延迟")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="余额接口返回 503 的概率")
+    args = parser.parse_args()
+
+    site = MockSite(args.host, args.port, args.latency_ms, args.jitter_ms, args.page_latency_ms, args.error_rate)
+    print(f"Mock gift card site: {site.url}")
+    try:
+        site.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
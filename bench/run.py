@@ -0,0 +1,340 @@
+"""针对本地模拟站点的吞吐量基准测试。
+
+    python -m bench.run --cards 60 --workers 3 --latency-ms 300 --output bench_results.json
+
+场景：
+- batches  process_card_batches，不使用页面池（每个 worker 冷启动一个浏览器）
+- pool     process_card_batches + PagePool
+- flask    通过 Flask test client 并发调用 /check_lululemon_gift_card_values
+- cli      bulk_check.py 批量命令行（子进程）
+- layouts  PagePool 分别使用 --layouts 里的每种浏览器拓扑（per_page 或 shared:<每个 context 的页面数>）
+
+输出每个场景的 cards/min、单卡耗时 p50/p95/p99 和浏览器进程的峰值 RSS。
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import csv
+import importlib
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench.mock_site import MockSite
+from bench.stats import summarize_latencies
+
+try:
+    import psutil
+    USE_PSUTIL = True
+except ImportError:
+    USE_PSUTIL = False
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ["batches", "pool", "flask", "cli", "layouts"]
+
+
+def descendant_rss_bytes(root_pid):
+    """root_pid 所有子孙进程（浏览器、Playwright driver）的 RSS 之和。"""
+    if USE_PSUTIL:
+        try:
+            children = psutil.Process(root_pid).children(recursive=True)
+        except psutil.Error:
+            return 0
+        total = 0
+        for child in children:
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+
+    parents, rss = {}, {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(entry)] = int(fields[1])
+            rss[int(entry)] = int(fields[21]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    total = 0
+    for pid in parents:
+        parent = parents.get(pid)
+        while parent and parent != root_pid:
+            parent = parents.get(parent)
+        if parent == root_pid:
+            total += rss.get(pid, 0)
+    return total
+
+
+class RssSampler:
+    def __init__(self, interval_s=0.5):
+        self.interval_s = interval_s
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, descendant_rss_bytes(os.getpid()))
+            self._stop.wait(self.interval_s)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def fake_card_numbers(count, seed=42):
+    rng = random.Random(seed)
+    return ["6051" + "".join(rng.choice("0123456789") for _ in range(15)) for _ in range(count)]
+
+
+class LatencyRecorder:
+    """包一层 card_processing.check_card_on_page，记录每张卡的耗时。"""
+
+    def __init__(self):
+        self.latencies_ms = []
+        self._lock = threading.Lock()
+
+    def install(self, card_processing):
+        original = card_processing.check_card_on_page
+
+        async def timed(page, card_number, label, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await original(page, card_number, label, **kwargs)
+            finally:
+                with self._lock:
+                    self.latencies_ms.append(round((time.perf_counter() - started) * 1000, 1))
+
+        card_processing.check_card_on_page = timed
+        return original
+
+
+def scenario_report(name, cards, errors, wall_s, latencies_ms, peak_rss):
+    return {
+        "scenario": name,
+        "cards": cards,
+        "errors": errors,
+        "wall_s": round(wall_s, 2),
+        "cards_per_min": round(cards / wall_s * 60, 1) if wall_s else None,
+        "latency": summarize_latencies(latencies_ms),
+        "peak_browser_rss_mb": round(peak_rss / 1024 / 1024, 1),
+    }
+
+
+def count_errors(results):
+    return sum(1 for result in results if result.get("outcome") != "balance_found")
+
+
+def parse_layout(layout):
+    """per_page -> None；shared:3 -> 每个 context 3 个页面。"""
+    if layout == "per_page":
+        return None
+    topology, _, pages_per_context = layout.partition(":")
+    if topology != "shared":
+        raise ValueError(f"unknown layout '{layout}'")
+    return int(pages_per_context or 1)
+
+
+def run_batches(cards, workers, use_pool, layout=None):
+    card_processing = importlib.import_module("card_processing")
+    page_pool = importlib.import_module("page_pool")
+    browser_host = importlib.import_module("browser_host")
+    recorder = LatencyRecorder()
+    original = recorder.install(card_processing)
+    pages_per_context = parse_layout(layout) if layout else None
+
+    async def run():
+        pool, host = None, None
+        if use_pool:
+            if pages_per_context is not None:
+                host = browser_host.BrowserHost(pages_per_context=pages_per_context)
+            pool = page_pool.PagePool(size=workers, host=host)
+            await pool.start()
+        try:
+            started = time.perf_counter()
+            results = await card_processing.process_card_batches(cards, workers, pool=pool)
+            wall_s = time.perf_counter() - started
+            traffic = [page["traffic"] for page in pool.stats()["pages"] if page["traffic"]] if pool else []
+            return results, wall_s, traffic
+        finally:
+            if pool is not None:
+                await pool.close()
+            if host is not None:
+                await host.close()
+
+    try:
+        with RssSampler() as sampler:
+            results, wall_s, traffic = asyncio.run(run())
+    finally:
+        card_processing.check_card_on_page = original
+    name = ("pool" if use_pool else "batches") + (f"[{layout}]" if layout else "")
+    report = scenario_report(name, len(cards), count_errors(results), wall_s, recorder.latencies_ms, sampler.peak)
+    report["peak_rss_mb_per_page"] = round(report["peak_browser_rss_mb"] / workers, 1)
+    if traffic:
+        report["traffic"] = {key: sum(page[key] for page in traffic) for key in traffic[0]}
+    return report
+
+
+def run_flask(cards, workers):
+    card_processing = importlib.import_module("card_processing")
+    recorder = LatencyRecorder()
+    original = recorder.install(card_processing)
+    app_module = importlib.import_module("app")
+    client = app_module.app.test_client()
+    app_module.get_page_pools()
+
+    def post(chunk):
+        items = [
+            {"card_type": "Lululemon-GC", "card_number": card, "card_issue_country": "AU", "calling_time": int(time.time())}
+            for card in chunk
+        ]
+        response = client.post("/check_lululemon_gift_card_values", json=items)
+        return response.get_json().get("results", [])
+
+    chunks = [cards[i:i + app_module.MAX_THREADS] for i in range(0, len(cards), app_module.MAX_THREADS)]
+    try:
+        with RssSampler() as sampler:
+            started = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                results = [item for chunk_results in executor.map(post, chunks) for item in chunk_results]
+            wall_s = time.perf_counter() - started
+    finally:
+        card_processing.check_card_on_page = original
+        app_module.runtime.stop()
+    errors = len(cards) - sum(1 for item in results if item.get("is_call_success"))
+    return scenario_report("flask", len(cards), errors, wall_s, recorder.latencies_ms, sampler.peak)
+
+
+def run_cli(cards, url, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        input_file = Path(tmp) / "data.csv"
+        with open(input_file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Card Number", "Balance"])
+            writer.writerows([card] for card in cards)
+
+        output_file = Path(tmp) / "price.csv"
+        env = dict(os.environ, LULU_GIFT_CARD_URL=url, LULU_HEADLESS="1")
+        with RssSampler() as sampler:
+            started = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "bulk_check.py", "--input", str(input_file), "--output", str(output_file),
+                 "--workers", str(workers)],
+                cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False,
+            )
+            wall_s = time.perf_counter() - started
+        errors = len(cards)
+        if output_file.exists():
+            with open(output_file, newline="") as f:
+                rows = list(csv.DictReader(f))
+            errors = len(cards) - sum(1 for row in rows if row.get("Outcome") == "balance_found")
+    # 在子进程里运行，拿不到单卡耗时，只统计吞吐量（包含浏览器启动时间）
+    return scenario_report("cli", len(cards), errors, wall_s, [], sampler.peak)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--page-latency-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument(
+        "--layouts", default="per_page,shared:1,shared:3",
+        help="layouts 场景对比的浏览器拓扑，shared:N 表示一个浏览器、每个 context N 个页面",
+    )
+    parser.add_argument("--pacing", default="zero", help="节奏策略（pacing.py），默认 zero 不加任何等待")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    scenarios = args.scenarios.split(",")
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    site = MockSite(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        page_latency_ms=args.page_latency_ms,
+        error_rate=args.error_rate,
+    ).start()
+    tmp = tempfile.mkdtemp()
+    # 这些配置在模块导入时读取，必须在导入项目模块之前设置
+    os.environ["LULU_GIFT_CARD_URL"] = site.url
+    os.environ.setdefault("LULU_HEADLESS", "1")
+    os.environ["LULU_POOL_SIZE"] = str(args.workers)
+    os.environ["LULU_JOBS_DB_PATH"] = os.path.join(tmp, "jobs.sqlite3")
+    # 模拟站点的 URL 就是 AU 地区的 URL，不隔离的话会读写生产的 files/storage_state/AU.json，
+    # 结果也会受上一次运行留下的状态影响
+    os.environ["LULU_STORAGE_STATE_DIR"] = os.path.join(tmp, "storage_state")
+    # 环境变量同时传给 cli 场景的 bulk_check 子进程和分片 worker
+    os.environ["LULU_PACING_PROFILE"] = args.pacing
+    # 按页面统计请求数和字节数，报告里对比拦截的效果
+    os.environ["LULU_TRACK_PAGE_TRAFFIC"] = "1"
+    importlib.import_module("log_config").setup_logging("bench")
+
+    cards = fake_card_numbers(args.cards)
+    reports = []
+    try:
+        for scenario in scenarios:
+            logging.info(f"Running benchmark scenario '{scenario}' with {len(cards)} cards")
+            if scenario in ("batches", "pool"):
+                reports.append(run_batches(cards, args.workers, use_pool=scenario == "pool"))
+            elif scenario == "flask":
+                reports.append(run_flask(cards, args.workers))
+            elif scenario == "cli":
+                reports.append(run_cli(cards, site.url, args.workers))
+            elif scenario == "layouts":
+                for layout in args.layouts.split(","):
+                    reports.append(run_batches(cards, args.workers, use_pool=True, layout=layout))
+    finally:
+        site.stop()
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "config": {
+            "cards": args.cards,
+            "workers": args.workers,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "page_latency_ms": args.page_latency_ms,
+            "error_rate": args.error_rate,
+            "pacing": args.pacing,
+        },
+        "scenarios": reports,
+    }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
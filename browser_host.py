@@ -0,0 +1,123 @@
+"""一个进程只启动一个 Chromium，页面池的页面分布在多个相互隔离的 BrowserContext 里。
+
+LULU_BROWSER_TOPOLOGY=shared 时使用：每个 context 最多 pages_per_context 个页面，满了再开新的 context；
+locale/时区是 context 级别的设置，所以不同地区的页面不会放进同一个 context。
+默认的 per_page 拓扑仍然是每个页面一个独立的 driver + 浏览器（init_driver），隔离最彻底但内存占用最高。
+
+浏览器崩溃或断开后，下一次 new_page 会重新启动它；已经坏掉的页面由页面池照常替换。
+"""
+import asyncio
+import logging
+
+from playwright.async_api import async_playwright
+
+from playwright_init import launch_browser, new_context, new_page
+from resource_policy import DEFAULT_POLICY
+from settings import HEADLESS, PAGES_PER_CONTEXT
+from storage_state import track_page
+
+
+class _ContextSlot:
+    def __init__(self, context, key):
+        self.context = context
+        self.key = key
+        self.pages = 0
+        self.draining = False
+
+
+class BrowserHost:
+    def __init__(self, headless=HEADLESS, pages_per_context=PAGES_PER_CONTEXT, resource_policy=DEFAULT_POLICY):
+        self.headless = headless
+        self.pages_per_context = max(pages_per_context, 1)
+        self.resource_policy = resource_policy
+        self.playwright = None
+        self.browser = None
+        self._contexts = []
+        self._lock = asyncio.Lock()
+        self.launches = 0
+
+    async def _ensure_browser(self):
+        if self.browser is not None and self.browser.is_connected():
+            return
+        if self.browser is not None:
+            logging.error("Shared browser disconnected, relaunching it")
+            self._contexts.clear()
+        if self.playwright is None:
+            self.playwright = await async_playwright().start()
+        self.browser = await launch_browser(self.playwright, self.headless)
+        self.launches += 1
+        logging.info(f"Shared browser launched ({self.pages_per_context} pages per context)")
+
+    async def new_page(self, locale, timezone, storage_state_path=None):
+        """在有空位的 context 里开一个页面，返回 (context, page)；新开的 context 加载 storage_state_path。"""
+        async with self._lock:
+            await self._ensure_browser()
+            key = (locale, timezone, storage_state_path)
+            slot = next(
+                (
+                    slot
+                    for slot in self._contexts
+                    if slot.key == key and not slot.draining and slot.pages < self.pages_per_context
+                ),
+                None,
+            )
+            if slot is None:
+                slot = _ContextSlot(
+                    await new_context(self.browser, locale, timezone, storage_state_path), key
+                )
+                self._contexts.append(slot)
+            slot.pages += 1
+        try:
+            page = await new_page(slot.context, self.resource_policy)
+        except Exception:
+            await self.close_page(slot.context, None)
+            raise
+        track_page(page, storage_state_path)
+        return slot.context, page
+
+    def drain(self, context):
+        """context 要回收：不再往里面开新页面，已有页面都关闭后 context 随之关闭。"""
+        slot = next((slot for slot in self._contexts if slot.context is context), None)
+        if slot is not None:
+            slot.draining = True
+
+    async def close_page(self, context, page):
+        """关闭页面；context 里没有页面后一起关掉，释放它的进程和内存。"""
+        if page is not None:
+            try:
+                await page.close()
+            except Exception as e:
+                logging.warning(f"Failed to close shared browser page: {e}")
+        slot = next((slot for slot in self._contexts if slot.context is context), None)
+        if slot is None:
+            return
+        slot.pages -= 1
+        if slot.pages <= 0:
+            self._contexts.remove(slot)
+            try:
+                await context.close()
+            except Exception as e:
+                logging.warning(f"Failed to close shared browser context: {e}")
+
+    def stats(self):
+        return {
+            "topology": "shared",
+            "pages_per_context": self.pages_per_context,
+            "contexts": len(self._contexts),
+            "draining_contexts": sum(1 for slot in self._contexts if slot.draining),
+            "pages": sum(slot.pages for slot in self._contexts),
+            "launches": self.launches,
+        }
+
+    async def close(self):
+        self._contexts.clear()
+        try:
+            if self.browser is not None:
+                await self.browser.close()
+            if self.playwright is not None:
+                await self.playwright.stop()
+        except Exception as e:
+            logging.error(f"Failed to close shared browser: {e}")
+        self.browser = None
+        self.playwright = None
+        logging.info("Shared browser closed")
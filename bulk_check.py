@@ -0,0 +1,210 @@
+"""批量查询 CSV 里的礼品卡余额（取代 scripts/check_values.py 和 scripts/raw_check.py）。
+
+    python bulk_check.py --input files/data.csv --output files/price.csv --workers 3
+    python bulk_check.py --input cards.csv --output results.ndjson --format ndjson
+    python bulk_check.py --input files/data.csv --output files/price.csv --resume
+    python bulk_check.py --input big.csv --output big_price.csv --processes 4 --workers 3
+    python bulk_check.py --input nz_cards.csv --output nz_price.csv --region NZ
+
+输入按块流式读取（第一列是卡号，首行表头会被跳过），每查完一张卡就追加写入
+<output>.journal（按批 fsync），全部查完后按输入顺序压缩成输出文件，内存占用与输入文件大小无关。
+Row 列是卡号在输入文件里的行号（从 0 开始）。中途崩溃或被 pm2 重启后，加 --resume 重跑会跳过
+journal 里已经有结果（查到余额或无效卡）的行。
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import signal
+import sys
+import time
+
+from tqdm import tqdm
+
+from card_processing import check_card_with_pool, summarize_worker_idle
+from checkpoint import CheckpointJournal, RowSet, compact, completed_rows
+from governor import GOVERNOR
+from log_config import setup_logging
+from metrics import QUEUE_DEPTH, format_summary
+from page_pool import PagePool
+from regions import REGIONS, get_region
+from sharding import ShardCoordinator
+from settings import DEFAULT_REGION, HEADLESS, POOL_SIZE
+
+FORMATS = ["csv", "ndjson"]
+
+
+def iter_card_chunks(path, chunk_size):
+    """逐块读取 (行号, 卡号)；行号不含表头，空行和空卡号会被跳过但仍占一个行号。"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        chunk = []
+        row = 0
+        for i, fields in enumerate(reader):
+            card_number = fields[0].strip() if fields else ""
+            if i == 0 and not card_number.isdigit():
+                continue
+            if card_number:
+                chunk.append((row, card_number))
+            row += 1
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def iter_pending_cards(path, chunk_size, done=()):
+    for chunk in iter_card_chunks(path, chunk_size):
+        for item in chunk:
+            if item[0] not in done:
+                yield item
+
+
+def open_journal(output_path, journal_path, resume):
+    journal_path = journal_path or output_path + ".journal"
+    done = completed_rows(journal_path) if resume else RowSet()
+    if resume:
+        logging.info(f"从 {journal_path} 恢复，跳过 {len(done)} 张已完成的卡")
+    return CheckpointJournal(journal_path).open(resume=resume), done
+
+
+async def produce(path, chunk_size, queue, num_workers, done=()):
+    total = 0
+    for item in iter_pending_cards(path, chunk_size, done):
+        await queue.put(item)
+        QUEUE_DEPTH.inc()
+        total += 1
+    for _ in range(num_workers):
+        await queue.put(None)
+    return total
+
+
+async def consume(worker_id, pool, queue, journal, stats, progress):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        QUEUE_DEPTH.dec()
+        row, card_number = item
+        started = time.monotonic()
+        result = await check_card_with_pool(pool, card_number, f"Worker {worker_id} row {row}")
+        stats["busy_s"] += time.monotonic() - started
+        stats["cards"] += 1
+        stats["outcomes"][result["outcome"]] = stats["outcomes"].get(result["outcome"], 0) + 1
+        journal.append(row, result)
+        progress.update(1)
+
+
+async def run(
+    input_path, output_path, workers, fmt="csv", chunk_size=1000, url=None, headless=HEADLESS,
+    resume=False, journal_path=None, region=None,
+):
+    journal, done = open_journal(output_path, journal_path, resume)
+    # 页面数由 --workers 决定，并发上限跟着放开到页面数
+    GOVERNOR.set_bounds(max_limit=workers)
+    pool = PagePool(size=workers, url=url, headless=headless, region=region)
+    # 队列有上限，读得比查得快时生产者会等待，保证内存占用不随输入增长
+    queue = asyncio.Queue(maxsize=max(chunk_size, workers))
+    # 不按卡记录耗时（durations），内存占用不随输入增长；idle 里因此没有静态切分的对比
+    worker_stats = [{"busy_s": 0.0, "cards": 0, "outcomes": {}} for _ in range(workers)]
+    progress = tqdm(desc="Processing cards", unit="card", initial=len(done))
+    await pool.start()
+    started = time.monotonic()
+    try:
+        total, *_ = await asyncio.gather(
+            produce(input_path, chunk_size, queue, workers, done),
+            *(consume(worker_id + 1, pool, queue, journal, worker_stats[worker_id], progress)
+              for worker_id in range(workers)),
+        )
+    finally:
+        progress.close()
+        journal.close()
+        await pool.close()
+
+    compact(journal.path, output_path, fmt)
+
+    outcomes = {}
+    for stats in worker_stats:
+        for outcome, count in stats["outcomes"].items():
+            outcomes[outcome] = outcomes.get(outcome, 0) + count
+    idle = summarize_worker_idle(worker_stats, time.monotonic() - started)
+    logging.info(f"本次查询 {total} 张卡，结果 {outcomes}，已写入 {output_path}")
+    logging.info(f"Worker idle time: {idle}")
+    return {"cards": total, "outcomes": outcomes, "idle": idle}
+
+
+def run_sharded(
+    input_path, output_path, processes, workers, fmt="csv", chunk_size=1000, url=None, headless=HEADLESS,
+    resume=False, journal_path=None, region=None,
+):
+    """多进程版本：协调进程读输入、写 journal，卡号按空闲容量分给 processes 个 worker 进程。"""
+    journal, done = open_journal(output_path, journal_path, resume)
+    outcomes = {}
+    progress = tqdm(desc="Processing cards", unit="card", initial=len(done))
+
+    def on_result(row, result):
+        journal.append(row, result)
+        outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+        progress.update(1)
+
+    coordinator = ShardCoordinator(processes, workers, url=url, headless=headless, region=region).start()
+    try:
+        throughput = coordinator.map(iter_pending_cards(input_path, chunk_size, done), on_result)
+    finally:
+        coordinator.stop()
+        progress.close()
+        journal.close()
+
+    compact(journal.path, output_path, fmt)
+    for shard in throughput:
+        logging.info(
+            f"Shard {shard['worker_id']} (pid {shard['pid']}): {shard['cards']} cards, "
+            f"{shard['cards_per_min']} cards/min"
+        )
+    total = sum(shard["cards"] for shard in throughput)
+    logging.info(f"本次查询 {total} 张卡，结果 {outcomes}，已写入 {output_path}")
+    return {"cards": total, "outcomes": outcomes, "processes": throughput}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default="files/data.csv", help="输入 CSV，第一列是卡号")
+    parser.add_argument("--output", default="files/price.csv")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--workers", type=int, default=POOL_SIZE, help="同时查询的页面数（多进程时是每个进程的页面数）")
+    parser.add_argument("--processes", type=int, default=1, help="worker 进程数，大于 1 时启用多进程分片")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="每次从输入读取的行数")
+    parser.add_argument("--region", default=DEFAULT_REGION, help=f"输入文件里卡的发行地区，可选 {sorted(REGIONS)}")
+    parser.add_argument("--url", default=None, help="覆盖地区的查询页面 URL")
+    parser.add_argument("--resume", action="store_true", help="跳过 journal 里已经完成的卡，继续上次的运行")
+    parser.add_argument("--journal", default=None, help="默认是 <output>.journal")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    setup_logging("bulk_check")
+    if args.workers < 1:
+        raise SystemExit("--workers must be at least 1")
+    try:
+        region = get_region(args.region)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    # pm2 停止/重启时发送 SIGTERM，转成正常退出，让 journal 把最后一批结果 fsync 掉
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(143))
+    if args.processes > 1:
+        run_sharded(
+            args.input, args.output, args.processes, args.workers, args.format, args.chunk_size, args.url,
+            resume=args.resume, journal_path=args.journal, region=region,
+        )
+    else:
+        asyncio.run(run(
+            args.input, args.output, args.workers, args.format, args.chunk_size, args.url,
+            resume=args.resume, journal_path=args.journal, region=region,
+        ))
+    print(format_summary())
+
+
+if __name__ == "__main__":
+    main()
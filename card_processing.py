@@ -1,9 +1,30 @@
 import asyncio
 import logging
+import threading
 from playwright_helpers import close_popup, human_like_actions, input_card_number_and_check, open_check_dialogue, click_check_another_card
+from playwright_helpers import BALANCE_FOUND, BLOCKED, PAGE_DESYNC, TRANSIENT_TIMEOUT
+from page_state import DIALOG_OPEN, ensure_dialog_open
+from regions import DEFAULT_SELECTORS, UNSUPPORTED_REGION, get_region, resolve_region
+from governor import GOVERNOR
+from log_config import card_log_context
 from playwright_init import init_driver
+from metrics import CARDS_CHECKED, QUEUE_DEPTH, card_stage_timings, stage_timer
+from settings import GIFT_CARD_URL, HEADLESS
+from storage_state import storage_state_path
 import time
 
+LULU_CARD_TYPE = "Lululemon-GC"
+
+# 结果里 timings_ms 的字段 <- metrics 里的阶段名
+CARD_TIMING_STAGES = {
+    "pool_lease": "lease",
+    "recover": "recover",
+    "pre_input_sleep": "pacing",
+    "input": "input",
+    "balance_wait": "balance_wait",
+    "reset": "reset",
+}
+
 def split_card_numbers(card_numbers, num_batches):
     k, m = divmod(len(card_numbers), num_batches)
     return [
@@ -11,51 +32,371 @@ def split_card_numbers(card_numbers, num_batches):
         for i in range(num_batches)
     ]
 
-async def process_card_batch(batch_id, card_numbers):
-    logging.info(f"Batch {batch_id} started processing {len(card_numbers)} cards")
-    results = []
+def build_card_queue(card_numbers, skip=()):
+    """队列里每一项是 (index, card_number, 入队时间)，入队时间用于计算 queue_wait。"""
+    queue = asyncio.Queue()
+    queued_at = time.monotonic()
+    for index, card_number in enumerate(card_numbers):
+        if index not in skip:
+            queue.put_nowait((index, card_number, queued_at))
+    QUEUE_DEPTH.inc(queue.qsize())
+    return queue
+
+def take_card(queue):
+    """从队列取下一张卡，队列为空时返回 None。"""
     try:
-        playwright, browser, context, page = await init_driver(headless=False)
-        print("===浏览器已经初始化 准备跳转===")
-        await page.goto("https://www.lululemon.com.au/en-au/content/gift-cards/gift-cards.html")
-        print("===窗口页面已经跳转完毕===")
-        await close_popup(page)
-        print("===已经关闭/跳过了popup的窗口====")
-        await open_check_dialogue(page)
-        print("===已经打开查询的窗口====")
-
-        for idx, card_number in enumerate(card_numbers, start=1):
-            logging.info(f"Batch {batch_id} => Checking card {idx}/{len(card_numbers)}: {card_number}")
-            logging.info(f"开始查询卡号: {card_number}")
-            balance = await input_card_number_and_check(page, card_number)
-            results.append({
-                "card_number": card_number,
-                "balance": balance,
-                "timestamp": int(time.time())
-            })
-
-            if balance != "Error":
-                try:
-                    await human_like_actions(page)
-                    await click_check_another_card(page)
-                except Exception as e:
-                    logging.error(f"Batch {batch_id} failed to return to input page: {e}")
+        item = queue.get_nowait()
+    except asyncio.QueueEmpty:
+        return None
+    QUEUE_DEPTH.dec()
+    return item
+
+def cached_result(card_number, entry):
+    return {
+        "card_number": card_number,
+        "balance": entry["balance"],
+        "outcome": BALANCE_FOUND,
+        "timestamp": int(entry["timestamp"]),
+        "from_cache": True,
+        "completed_at": round(time.time(), 3),
+        "timings_ms": None,
+    }
+
+def failed_result(card_number, outcome=TRANSIENT_TIMEOUT):
+    """没能在页面上查询的卡（租不到页面、worker 异常退出），按暂时性失败处理，调用方可以重试。"""
+    return {
+        "card_number": card_number,
+        "balance": None,
+        "outcome": outcome,
+        "timestamp": int(time.time()),
+        "from_cache": False,
+        "completed_at": round(time.time(), 3),
+        "timings_ms": None,
+    }
+
+def stamp_timings(result, stages, queue_wait_s, queued_at):
+    """给结果加上这张卡的耗时（单调时钟，ms）和完成时的墙上时间，不受调用方时钟偏差影响。
+
+    queue_wait 是排队等待的时间（入队到开始租页面，加上拿到页面后等并发名额的时间，不含租页面本身），
+    total 是从入队到查完的时间。
+    """
+    timings = {"queue_wait": round(queue_wait_s * 1000, 1)}
+    for stage, name in CARD_TIMING_STAGES.items():
+        timings[name] = round(stages.get(stage, 0.0), 1)
+    timings["total"] = round((time.monotonic() - queued_at) * 1000, 1)
+    result["timings_ms"] = timings
+    result["completed_at"] = round(time.time(), 3)
+    return result
+
+def build_item_result(item, result):
+    """把单张卡的查询结果合并回调用方传入的原始对象。"""
+    output = dict(item)
+    output["is_call_success"] = result.get("outcome") == BALANCE_FOUND
+    output["outcome"] = result.get("outcome")
+    output["balance"] = result.get("balance")
+    output["balance_timestamp"] = result.get("timestamp")
+    output["from_cache"] = result.get("from_cache", False)
+    output["completed_at"] = result.get("completed_at")
+    output["timings_ms"] = result.get("timings_ms")
+    return output
+
+async def check_card_on_page(page, card_number, label, url=GIFT_CARD_URL, selectors=DEFAULT_SELECTORS):
+    """查询一张卡，返回 (result, 页面是否可以继续使用)。
+
+    查询前先通过状态机把页面带回输入框；查询时发现页面状态不对（page_desync）
+    会恢复一次再查，这样一次页面异常只影响当前这张卡，不会拖累后面的卡。
+    """
+    for attempt in range(2):
+        if await ensure_dialog_open(page, url, selectors) != DIALOG_OPEN:
+            CARDS_CHECKED.inc(result=PAGE_DESYNC)
+            logging.error(f"{label} could not bring the page back to the check dialog")
+            return failed_result(card_number, PAGE_DESYNC), False
+        check = await input_card_number_and_check(page, card_number, selectors=selectors)
+        if check["outcome"] != PAGE_DESYNC or attempt:
+            break
+        logging.warning(f"{label} page drifted out of the check dialog, recovering before retrying {card_number}")
+
+    CARDS_CHECKED.inc(result=check["outcome"])
+    result = {
+        "card_number": card_number,
+        "balance": check["balance"],
+        "outcome": check["outcome"],
+        "timestamp": int(time.time()),
+        "from_cache": False,
+    }
+    if check["outcome"] == BLOCKED:
+        # 这个浏览器已经被站点拦截，不应该继续用来查下一张卡
+        return result, False
+    if check["outcome"] == BALANCE_FOUND and not check["reset"]:
+        # 顺手回到输入框；失败也没关系，下一张卡查询前状态机会再处理
+        try:
+            with stage_timer("reset"):
+                await human_like_actions(page)
+                await click_check_another_card(page, selectors)
+        except Exception as e:
+            logging.warning(f"{label} failed to return to input page: {e}")
+    return result, True
+
+async def process_card_batch(batch_id, queue, publish, stats):
+    """从共享队列里取卡，直到队列为空；慢卡只会拖住当前这个 worker。"""
+    logging.info(f"Batch {batch_id} started, {queue.qsize()} cards waiting")
+    playwright, browser = None, None
+    try:
+        with stage_timer("init_driver"):
+            region = get_region()
+            playwright, browser, context, page = await init_driver(
+                headless=HEADLESS,
+                storage_state_path=storage_state_path(region.code) if region.url == GIFT_CARD_URL else None,
+            )
+        with stage_timer("goto"):
+            await page.goto(GIFT_CARD_URL)
+        with stage_timer("close_popup"):
+            await close_popup(page)
+        with stage_timer("open_check_dialogue"):
+            await open_check_dialogue(page)
+        logging.info(f"Batch {batch_id} page is on the check dialog")
+
+        while True:
+            item = take_card(queue)
+            if item is None:
+                break
+            index, card_number, queued_at = item
+            started = time.monotonic()
+            try:
+                with card_log_context(), card_stage_timings() as stages:
+                    logging.info(f"Batch {batch_id} => Checking card #{index}: {card_number}")
+                    async with GOVERNOR.slot():
+                        queue_wait_s = time.monotonic() - queued_at
+                        result, page_ready = await check_card_on_page(page, card_number, f"Batch {batch_id}")
+                        GOVERNOR.record(result["outcome"])
+                    stamp_timings(result, stages, queue_wait_s, queued_at)
+                publish(index, result)
+            finally:
+                record_card_duration(stats, index, time.monotonic() - started)
+            if not page_ready:
+                # 剩下的卡留在共享队列里，由其他 worker 继续处理
+                logging.error(f"Batch {batch_id} page is unusable, stopping this worker")
+                break
 
     except Exception as e:
         logging.critical(f"Batch {batch_id} encountered a fatal error: {e}")
     finally:
-        await browser.close()
-        await playwright.stop()
+        if browser:
+            await browser.close()
+            await playwright.stop()
         logging.info(f"Batch {batch_id} browser closed")
 
+async def check_card_with_pool(pool, card_number, label, queued_at=None):
+    """租一个页面查询一张卡；租不到页面或页面出错时返回 failed_result，不抛异常。
+
+    先租到页面，再向进程级的 GOVERNOR 申请并发名额，查完把结果报告给它用来调整上限。
+    这张卡的所有日志都带同一个 card_id（见 log_config.card_log_context），
+    结果带上各阶段耗时（见 stamp_timings）；queued_at 是卡入队的时间，默认为调用时。
+    """
+    queued_at = queued_at if queued_at is not None else time.monotonic()
+    with card_log_context(), card_stage_timings() as stages:
+        result, queue_wait_s = await _check_card_with_pool(pool, card_number, label, queued_at)
+        return stamp_timings(result, stages, queue_wait_s, queued_at)
+
+async def _check_card_with_pool(pool, card_number, label, queued_at):
+    lease_started = time.monotonic()
+    queue_wait_s = lease_started - queued_at
+    try:
+        async with pool.lease() as slot:
+            # 拿到页面之后才占全局名额：等某个地区的页面时不占名额，其他地区的空闲页面照常接单
+            leased = time.monotonic()
+            async with GOVERNOR.slot():
+                queue_wait_s += time.monotonic() - leased
+                logging.info(f"{label} / pool slot {slot.slot_id} => Checking card {card_number}")
+                try:
+                    result, page_ready = await check_card_on_page(
+                        slot.page, card_number, f"Pool {pool.region.code} slot {slot.slot_id}",
+                        url=pool.url, selectors=pool.selectors,
+                    )
+                except Exception:
+                    GOVERNOR.record(TRANSIENT_TIMEOUT)
+                    raise
+                GOVERNOR.record(result["outcome"])
+                if not page_ready:
+                    slot.broken = True
+    except Exception as e:
+        # 租页面超时只说明本地页面不够用，不报告给 GOVERNOR，不当成站点过载
+        logging.error(f"Card {card_number} could not be checked on the page pool: {e}")
+        result = failed_result(card_number)
+    return result, queue_wait_s
+
+async def process_pool_worker(worker_id, pool, queue, publish, stats):
+    while True:
+        item = take_card(queue)
+        if item is None:
+            return
+        index, card_number, queued_at = item
+        started = time.monotonic()
+        result = None
+        try:
+            result = await check_card_with_pool(pool, card_number, f"Worker {worker_id} card #{index}", queued_at)
+        finally:
+            publish(index, result if result is not None else failed_result(card_number))
+            record_card_duration(stats, index, time.monotonic() - started)
+
+def record_card_duration(stats, index, seconds):
+    """记录 worker 的忙碌时间；stats 里有 durations 时按输入下标记下每张卡的实际耗时。"""
+    stats["busy_s"] += seconds
+    stats["cards"] += 1
+    if "durations" in stats:
+        stats["durations"][index] = seconds
+
+def summarize_worker_idle(worker_stats, wall_s):
+    """空闲时间 = 整体耗时 - 各 worker 的忙碌时间。
+
+    worker 记录了每张卡的实际耗时（stats["durations"]，下标 -> 秒）时，再把同样的卡按旧的
+    静态切分（split_card_numbers，按输入顺序切成连续的几段）重新分配，用实际耗时算出
+    静态切分的总耗时（最慢的一段）和空闲时间，慢卡集中在某一段时差别就体现在这里。
+    """
+    idle_s = sum(max(wall_s - stats["busy_s"], 0.0) for stats in worker_stats)
+    total_cards = sum(stats["cards"] for stats in worker_stats)
+    workers = len(worker_stats)
+    summary = {
+        "workers": workers,
+        "cards": total_cards,
+        "wall_s": round(wall_s, 3),
+        "idle_s": round(idle_s, 3),
+        "idle_ratio": round(idle_s / (wall_s * workers), 3) if wall_s and workers else 0.0,
+    }
+    durations = {}
+    for stats in worker_stats:
+        durations.update(stats.get("durations", {}))
+    if durations and workers:
+        static_batches = split_card_numbers([durations[index] for index in sorted(durations)], workers)
+        static_busy = [sum(batch) for batch in static_batches]
+        makespan = max(static_busy)
+        summary["static_split_wall_s"] = round(makespan, 3)
+        summary["static_split_idle_s"] = round(sum(makespan - busy for busy in static_busy), 3)
+    return summary
+
+async def check_cards_on_shards(shards, card_numbers, skip, publish):
+    """把没命中缓存的卡交给多进程的 ShardCoordinator；它的 map 是阻塞调用，放到线程池里执行。"""
+    loop = asyncio.get_running_loop()
+    cancel = threading.Event()
+
+    def on_result(index, result):
+        # map 在线程池里回调，结果交回事件循环线程处理
+        loop.call_soon_threadsafe(publish, index, result)
+
+    items = [(index, card_number) for index, card_number in enumerate(card_numbers) if index not in skip]
+    try:
+        throughput = await loop.run_in_executor(None, shards.map, items, on_result, cancel)
+    except asyncio.CancelledError:
+        # 不再分发新卡；已经发出去的卡查完后 map 会自己返回
+        cancel.set()
+        raise
+    logging.info(f"Shard throughput: {throughput}")
+
+async def process_card_batches(card_numbers, max_threads, pool=None, cache=None, max_age=None, on_result=None,
+                               shards=None, region=None):
+    """按输入顺序返回每张卡的结果；on_result(index, result) 会在每张卡完成时立即被调用。
+
+    region 是这批卡所在地区的代码，缓存按它分开读写。
+
+    传入 shards（sharding.ShardCoordinator）时，没命中缓存的卡交给多个 worker 进程查询，
+    此时 max_threads 和 pool 不起作用。
+    """
+    results = [None] * len(card_numbers)
+
+    def publish(index, result):
+        results[index] = result
+        if cache is not None and not result["from_cache"] and result["outcome"] == BALANCE_FOUND:
+            cache.set(result["card_number"], result["balance"], result["timestamp"], region=region)
+        if on_result is not None:
+            on_result(index, result)
+
+    if cache is not None:
+        for index, card_number in enumerate(card_numbers):
+            entry = cache.get(card_number, max_age=max_age, region=region)
+            if entry is not None:
+                CARDS_CHECKED.inc(result="cache")
+                publish(index, cached_result(card_number, entry))
+    hits = {index for index, result in enumerate(results) if result is not None}
+    misses = len(card_numbers) - len(hits)
+    if not misses:
+        return results
+
+    if shards is not None:
+        await check_cards_on_shards(shards, card_numbers, hits, publish)
+        return [
+            result if result is not None else failed_result(card_numbers[index])
+            for index, result in enumerate(results)
+        ]
+
+    queue = build_card_queue(card_numbers, skip=hits)
+    num_workers = max(min(max_threads, misses), 1)
+    worker_stats = [{"busy_s": 0.0, "cards": 0, "durations": {}} for _ in range(num_workers)]
+
+    started = time.monotonic()
+    if pool is not None:
+        # 页面池决定真正的并发上限，worker 只负责从队列取卡并租用页面
+        tasks = [
+            process_pool_worker(worker_id + 1, pool, queue, publish, worker_stats[worker_id])
+            for worker_id in range(num_workers)
+        ]
+    else:
+        tasks = [
+            process_card_batch(worker_id + 1, queue, publish, worker_stats[worker_id])
+            for worker_id in range(num_workers)
+        ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # 被取消或出错时把没取走的卡从队列深度里扣掉
+        QUEUE_DEPTH.dec(queue.qsize())
+
+    # 如果所有 worker 都异常退出，队列里剩下的卡也要有结果
+    for index, card_number in enumerate(card_numbers):
+        if results[index] is None:
+            publish(index, failed_result(card_number))
+    logging.info(f"Worker idle time: {summarize_worker_idle(worker_stats, time.monotonic() - started)}")
     return results
 
-async def process_card_batches(card_numbers, max_threads):
-    batches = split_card_numbers(card_numbers, max_threads)
-    logging.info(f"Divided into {len(batches)} batches")
+async def process_cards_by_region(card_numbers, countries, pools, cache=None, max_age=None, on_result=None,
+                                  shards=None):
+    """按 card_issue_country 把卡分到各地区的页面池，各地区并行查询，结果仍按输入顺序返回。
+
+    pools 是 page_pool.RegionPools；认不出的地区直接返回 unsupported_region，不占用页面。
+    shards 只用来查询它自己所在地区（shards.region）的卡。
+    """
+    results = [None] * len(card_numbers)
 
-    tasks = [process_card_batch(batch_id + 1, batch) for batch_id, batch in enumerate(batches)]
-    all_results = await asyncio.gather(*tasks)
+    def publish(index, result):
+        results[index] = result
+        if on_result is not None:
+            on_result(index, result)
 
-    final_results = [item for batch in all_results for item in batch]
-    return final_results
+    groups = {}
+    for index, (card_number, country) in enumerate(zip(card_numbers, countries)):
+        region = resolve_region(country)
+        if region is None:
+            logging.warning(f"Card {card_number} has unsupported card_issue_country {country!r}")
+            CARDS_CHECKED.inc(result=UNSUPPORTED_REGION)
+            publish(index, failed_result(card_number, UNSUPPORTED_REGION))
+        else:
+            groups.setdefault(region.code, (region, []))[1].append(index)
+
+    async def check_region(region, indexes):
+        pool = await pools.get(region)
+
+        def on_region_result(position, result):
+            publish(indexes[position], result)
+
+        await process_card_batches(
+            [card_numbers[index] for index in indexes],
+            pool.size,
+            pool=pool,
+            cache=cache,
+            max_age=max_age,
+            on_result=on_region_result,
+            shards=shards if shards is not None and shards.region.code == region.code else None,
+            region=region.code,
+        )
+
+    await asyncio.gather(*(check_region(region, indexes) for region, indexes in groups.values()))
+    return results
@@ -0,0 +1,179 @@
+"""批量查询的断点续跑：只追加的结果日志（journal）+ 结束时按输入顺序压缩成输出文件。
+
+journal 每行一个 JSON：{"row": 输入行号, "result": {...}}。写入按批 fsync，
+进程崩溃最多丢掉最后一批还没 fsync 的结果；最后一行写了一半的情况在读取时会被忽略。
+"""
+import csv
+import heapq
+import itertools
+import json
+import logging
+import os
+import tempfile
+import time
+
+from playwright_helpers import BALANCE_FOUND, INVALID_CARD
+
+# 这两类结果重跑也不会变，--resume 时跳过；暂时性失败、页面错乱、被拦截的卡会重新查询
+DONE_OUTCOMES = {BALANCE_FOUND, INVALID_CARD}
+
+CSV_FIELDS = ["Row", "Card Number", "Price", "Outcome", "Timestamp"]
+
+
+class RowSet:
+    """用位图记录已完成的行号，几百万行也只占几百 KB。"""
+
+    def __init__(self):
+        self._bits = bytearray()
+        self.count = 0
+
+    def add(self, row):
+        byte, bit = divmod(row, 8)
+        if byte >= len(self._bits):
+            self._bits.extend(bytes(byte - len(self._bits) + 1))
+        if not self._bits[byte] & (1 << bit):
+            self._bits[byte] |= 1 << bit
+            self.count += 1
+
+    def __contains__(self, row):
+        byte, bit = divmod(row, 8)
+        return byte < len(self._bits) and bool(self._bits[byte] & (1 << bit))
+
+    def __len__(self):
+        return self.count
+
+
+def read_journal(path):
+    """按写入顺序读出 (row, result)，忽略崩溃时写了一半的行。"""
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            try:
+                record = json.loads(line)
+                yield record["row"], record["result"]
+            except (ValueError, KeyError, TypeError):
+                logging.warning(f"journal {path} 第 {line_number} 行不完整，已忽略")
+
+
+def completed_rows(path):
+    done = RowSet()
+    for row, result in read_journal(path):
+        if result.get("outcome") in DONE_OUTCOMES:
+            done.add(row)
+    return done
+
+
+def _truncate_torn_tail(path):
+    """去掉崩溃时写了一半的最后一行，否则续写的第一条记录会和它拼在同一行里。"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            block = f.read(step)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position != end:
+            logging.warning(f"journal {path} 末尾有 {end - position} 字节不完整的记录，已截掉")
+            f.truncate(position)
+
+
+class CheckpointJournal:
+    """只追加的结果日志，每 fsync_every 条或每 fsync_interval_s 秒 fsync 一次。"""
+
+    def __init__(self, path, fsync_every=100, fsync_interval_s=1.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval_s = fsync_interval_s
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def open(self, resume=False):
+        if not resume and os.path.exists(self.path):
+            logging.warning(f"没有指定 --resume，已有的 journal {self.path} 会被覆盖")
+        if resume:
+            _truncate_torn_tail(self.path)
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        return self
+
+    def append(self, row, result):
+        self._file.write(json.dumps({"row": row, "result": result}, ensure_ascii=False) + "\n")
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval_s:
+            self.sync()
+
+    def sync(self):
+        if self._file is None or not self._pending:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+def _sorted_runs(journal_path, run_size, tmp_dir):
+    """外部排序的第一步：每 run_size 条按 (row, 写入序号) 排好写进一个临时文件。"""
+    records = enumerate(read_journal(journal_path))
+    while True:
+        run = sorted(
+            (row, seq, result) for seq, (row, result) in itertools.islice(records, run_size)
+        )
+        if not run:
+            return
+        f = tempfile.TemporaryFile("w+", encoding="utf-8", dir=tmp_dir)
+        for row, seq, result in run:
+            f.write(json.dumps([row, seq, result], ensure_ascii=False) + "\n")
+        f.seek(0)
+        yield f
+
+
+def _read_run(f):
+    for line in f:
+        yield tuple(json.loads(line))
+
+
+def compact(journal_path, output_path, fmt="csv", run_size=100000):
+    """按输入行号顺序写出最终结果；同一行查过多次时以最后一次为准。内存占用只和 run_size 有关。"""
+    tmp_dir = os.path.dirname(os.path.abspath(output_path))
+    runs = list(_sorted_runs(journal_path, run_size, tmp_dir))
+    tmp_output = output_path + ".tmp"
+    written = 0
+    try:
+        with open(tmp_output, "w", newline="", encoding="utf-8") as out:
+            writer = csv.writer(out) if fmt == "csv" else None
+            if writer:
+                writer.writerow(CSV_FIELDS)
+            merged = heapq.merge(*(_read_run(f) for f in runs), key=lambda record: (record[0], record[1]))
+            for row, records in itertools.groupby(merged, key=lambda record: record[0]):
+                *_, (_, _, result) = records
+                if writer:
+                    writer.writerow([
+                        row, result["card_number"], result["balance"] or "", result["outcome"], result["timestamp"],
+                    ])
+                else:
+                    out.write(json.dumps(dict(result, row=row), ensure_ascii=False) + "\n")
+                written += 1
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_output, output_path)
+    finally:
+        for f in runs:
+            f.close()
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+    logging.info(f"已按输入顺序写出 {written} 条结果到 {output_path}")
+    return written
@@ -0,0 +1,155 @@
+"""进程级的并发调节器：限制同时在查询的卡数，按 AIMD 自动调整上限。
+
+所有入口（同步接口、流式接口、异步任务、bulk_check）共用同一个 GOVERNOR。每查完一张卡记录一次结果：
+- 最近一个窗口里超时/被拦截的比例超过阈值，上限乘以 decrease_factor（乘性减）
+- 一个窗口内都正常，并且上限确实被用满过，上限加 1（加性增）
+上限始终在 [min_limit, max_limit] 之间；页面池的大小是实际并发的硬上限，所以 max_limit 默认等于池大小。
+"""
+import asyncio
+import collections
+import logging
+from contextlib import asynccontextmanager
+
+from metrics import CONCURRENCY_LIMIT, IN_FLIGHT_CHECKS
+from playwright_helpers import BLOCKED, TRANSIENT_TIMEOUT
+from settings import (
+    CONCURRENCY_DECREASE_FACTOR,
+    CONCURRENCY_ERROR_THRESHOLD,
+    CONCURRENCY_INITIAL,
+    CONCURRENCY_MAX,
+    CONCURRENCY_MIN,
+    CONCURRENCY_WINDOW,
+)
+
+# 这两类失败说明站点或本机已经过载；无效卡、页面错乱和并发无关
+CONGESTION_OUTCOMES = {TRANSIENT_TIMEOUT, BLOCKED}
+
+
+class ConcurrencyGovernor:
+    def __init__(self, min_limit=CONCURRENCY_MIN, max_limit=CONCURRENCY_MAX, initial=CONCURRENCY_INITIAL,
+                 window=CONCURRENCY_WINDOW, error_threshold=CONCURRENCY_ERROR_THRESHOLD,
+                 decrease_factor=CONCURRENCY_DECREASE_FACTOR):
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.window = window
+        self.error_threshold = error_threshold
+        self.decrease_factor = decrease_factor
+        self.initial = initial
+        self._limit = self._initial_limit()
+        self._in_flight = 0
+        self._saturated = False
+        self._samples = 0
+        self._errors = 0
+        self._waiters = collections.deque()
+        CONCURRENCY_LIMIT.set(self._limit)
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def _initial_limit(self):
+        return min(max(self.initial or self.max_limit, self.min_limit), self.max_limit)
+
+    def set_bounds(self, min_limit=None, max_limit=None):
+        """bulk_check 这类自己决定页面数的入口用它调整上下限，上限会重新从初始值开始。"""
+        if min_limit is not None:
+            self.min_limit = max(min_limit, 1)
+        if max_limit is not None:
+            self.max_limit = max(max_limit, self.min_limit)
+        self._reset_window()
+        self._set_limit(self._initial_limit())
+
+    def raise_max_limit(self, extra):
+        """运行中多了 extra 个页面（新地区的页面池）时放开上界。
+
+        上限没有被乘性减过（等于原来的上界）时跟着放开；已经退避过的上限保持不变，
+        之后由加性增慢慢涨回去，不会因为新地区预热就丢掉退避。
+        """
+        old_max = self.max_limit
+        self.max_limit += extra
+        if self._limit >= old_max:
+            self._set_limit(self.max_limit)
+
+    def _set_limit(self, limit):
+        if limit == self._limit:
+            return
+        logging.info(f"Concurrency limit {self._limit} -> {limit}")
+        self._limit = limit
+        CONCURRENCY_LIMIT.set(limit)
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        # 唤醒的数量可以多于空位，acquire 被唤醒后会重新检查
+        free = self._limit - self._in_flight
+        for waiter in self._waiters:
+            if free <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def record(self, outcome):
+        self._samples += 1
+        if outcome in CONGESTION_OUTCOMES:
+            self._errors += 1
+        # 样本太少时一两次超时不算过载，至少等到 window 的一半
+        if self._samples >= self.window // 2 and self._errors / self._samples > self.error_threshold:
+            self._set_limit(max(self.min_limit, int(self._limit * self.decrease_factor)))
+            self._reset_window()
+        elif self._samples >= self.window:
+            if self._saturated:
+                self._set_limit(min(self.max_limit, self._limit + 1))
+            self._reset_window()
+
+    def _reset_window(self):
+        self._samples = 0
+        self._errors = 0
+        self._saturated = False
+
+    async def acquire(self):
+        while self._in_flight >= self._limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 被唤醒后又被取消，把名额让给下一个等待者
+                self._wake_waiters()
+                raise
+            finally:
+                self._waiters.remove(waiter)
+        self._in_flight += 1
+        if self._in_flight >= self._limit:
+            self._saturated = True
+        IN_FLIGHT_CHECKS.set(self._in_flight)
+
+    def release(self):
+        self._in_flight -= 1
+        IN_FLIGHT_CHECKS.set(self._in_flight)
+        self._wake_waiters()
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个并发名额；调用方查完后用 governor.record(outcome) 报告结果。"""
+        await self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "limit": self._limit,
+            "in_flight": self._in_flight,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "window_samples": self._samples,
+            "window_errors": self._errors,
+        }
+
+
+GOVERNOR = ConcurrencyGovernor()
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import uuid
+
+from card_processing import process_cards_by_region
+from sharding import ShardsStopped
+from sqlite_writer import SqliteWriter
+from validation import CheckPlan
+from settings import JOB_CHUNK_SIZE, JOB_POLL_INTERVAL_S, JOBS_DB_PATH
+
+
+class JobStore:
+    """SQLite 持久化的任务队列，pm2 重启后未完成的任务会继续执行。
+
+    每张卡的结果由单独的写线程批量写入（见 sqlite_writer.py），不在事件循环上等磁盘。
+    """
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, "
+                "done INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS job_items ("
+                "job_id TEXT NOT NULL, idx INTEGER NOT NULL, item TEXT NOT NULL, "
+                "status TEXT NOT NULL DEFAULT 'pending', result TEXT, "
+                "PRIMARY KEY (job_id, idx))"
+            )
+            # 上次进程退出时正在跑的任务重新排队
+            db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        self._writer = SqliteWriter(path, name="job-writer")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create(self, items):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, total, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, len(items), now, now),
+            )
+            db.executemany(
+                "INSERT INTO job_items (job_id, idx, item) VALUES (?, ?, ?)",
+                [(job_id, idx, json.dumps(item)) for idx, item in enumerate(items)],
+            )
+        return job_id
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT status, total, done, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            results = [
+                dict(json.loads(result), index=idx)
+                for idx, result in db.execute(
+                    "SELECT idx, result FROM job_items WHERE job_id = ? AND status = 'done' ORDER BY idx",
+                    (job_id,),
+                )
+            ]
+        status, total, done, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total": total,
+            "done": done,
+            "progress": round(done / total, 4) if total else 1.0,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "results": results,
+        }
+
+    def cancel(self, job_id):
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+            if cursor.rowcount:
+                return True
+            return db.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is not None
+
+    def next_job(self):
+        with self._connect() as db:
+            while True:
+                row = db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                # SELECT 和 UPDATE 之间任务可能被 DELETE /jobs/<id> 取消，不能把它改回 running
+                cursor = db.execute(
+                    "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                    (time.time(), row[0]),
+                )
+                if cursor.rowcount:
+                    return row[0]
+
+    def status(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def pending_items(self, job_id, limit):
+        with self._connect() as db:
+            return [
+                (idx, json.loads(item))
+                for idx, item in db.execute(
+                    "SELECT idx, item FROM job_items WHERE job_id = ? AND status = 'pending' ORDER BY idx LIMIT ?",
+                    (job_id, limit),
+                )
+            ]
+
+    def save_result(self, job_id, idx, result):
+        """放进写队列后立即返回；需要读到刚写的结果时先调用 flush。
+
+        只有任务还在 running 时才写入，取消之后才查完的卡不再记入结果和进度。
+        """
+        payload = json.dumps(result)
+        updated_at = time.time()
+
+        def write(db):
+            cursor = db.execute(
+                "UPDATE job_items SET status = 'done', result = ? "
+                "WHERE job_id = ? AND idx = ? AND status = 'pending' "
+                "AND (SELECT status FROM jobs WHERE id = ?) = 'running'",
+                (payload, job_id, idx, job_id),
+            )
+            if cursor.rowcount:
+                db.execute("UPDATE jobs SET done = done + 1, updated_at = ? WHERE id = ?", (updated_at, job_id))
+
+        self._writer.submit(write)
+
+    def flush(self):
+        self._writer.flush()
+
+    def finish(self, job_id, status="completed"):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                (status, time.time(), job_id),
+            )
+
+
+class JobRunner:
+    """在共享事件循环上按顺序执行排队的任务，每次取一小块卡号按地区交给各自的页面池。"""
+
+    def __init__(self, store, cache=None, chunk_size=JOB_CHUNK_SIZE, poll_interval_s=JOB_POLL_INTERVAL_S, shards=None):
+        self.store = store
+        self.cache = cache
+        # 设置了 ShardCoordinator 时，任务里的卡交给多个 worker 进程查询
+        self.shards = shards
+        self.chunk_size = chunk_size
+        self.poll_interval_s = poll_interval_s
+        self._wake = None
+        self._loop = None
+        self._current_job_id = None
+        self._current_task = None
+        self._cancelled = set()
+
+    async def _store_call(self, method, *args):
+        """JobStore 的同步读写放到线程池里执行，不在事件循环上等 sqlite。"""
+        return await self._loop.run_in_executor(None, method, *args)
+
+    async def run_forever(self, pools):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        chunk_size = self.chunk_size or (self.shards or pools).size * 4
+        logging.info(f"Job runner started, chunk size {chunk_size}")
+        while True:
+            job_id = await self._store_call(self.store.next_job)
+            if job_id is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._current_job_id = job_id
+            self._current_task = asyncio.create_task(self._run_job(job_id, pools, chunk_size))
+            try:
+                await self._current_task
+            except asyncio.CancelledError:
+                # 只认本进程记下的取消；runner 自己被取消（进程退出）时继续抛出
+                if job_id not in self._cancelled:
+                    raise
+                logging.info(f"Job {job_id} cancelled")
+            except ShardsStopped:
+                # 进程正在退出，任务保持 running，下次启动时会重新排队
+                logging.warning(f"Job {job_id} interrupted because shard workers were stopped")
+                return
+            except Exception as e:
+                logging.error(f"Job {job_id} failed: {e}")
+                await self._store_call(self.store.finish, job_id, "failed")
+            finally:
+                self._current_job_id = None
+                self._current_task = None
+
+    async def _run_job(self, job_id, pools, chunk_size):
+        logging.info(f"Job {job_id} started")
+        while await self._store_call(self.store.status, job_id) == "running":
+            chunk = await self._store_call(self.store.pending_items, job_id, chunk_size)
+            if not chunk:
+                await self._store_call(self.store.finish, job_id)
+                logging.info(f"Job {job_id} completed")
+                return
+
+            # 非 Lululemon 的卡和格式不对的卡直接保存结果，块内重复的卡只查一次
+            plan = CheckPlan([item for _, item in chunk])
+            for position, output in plan.immediate_results():
+                self.store.save_result(job_id, chunk[position][0], output)
+
+            def on_result(position, result):
+                if job_id in self._cancelled:
+                    # 已经取消的任务：已发出去的卡查完后的结果直接丢掉
+                    return
+                for chunk_position, output in plan.expand(position, result):
+                    self.store.save_result(job_id, chunk[chunk_position][0], output)
+
+            await process_cards_by_region(
+                plan.card_numbers,
+                plan.countries,
+                pools,
+                cache=self.cache,
+                on_result=on_result,
+                shards=self.shards,
+            )
+            # 下一块从库里取还没完成的卡，先等这一块的结果都写进去
+            await self._store_call(self.store.flush)
+
+    def notify(self):
+        """可以从任意线程调用，唤醒空闲的 runner。"""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def cancel(self, job_id):
+        if not self.store.cancel(job_id):
+            return False
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._cancel_current, job_id)
+        return True
+
+    def _cancel_current(self, job_id):
+        self._cancelled.add(job_id)
+        if self._current_job_id == job_id and self._current_task is not None:
+            self._current_task.cancel()
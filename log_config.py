@@ -0,0 +1,122 @@
+"""日志管道：调用方只把记录放进内存队列，格式化和写文件在 QueueListener 的后台线程里完成。
+
+- 文件里每行一个 JSON（ts/level/logger/msg/card_id/process），终端输出仍是原来的文本格式
+- card_log_context() 给一张卡的查询过程分配 card_id，期间所有日志都带上它
+- 一张卡的 INFO/DEBUG 日志按 LOG_SAMPLE_INFO/LOG_SAMPLE_DEBUG 的比例整卡采样（要么全留要么全丢），
+  WARNING 及以上和不属于任何卡的日志始终保留
+- 日志里连续 12 位以上的数字（卡号）只保留前 4 位和后 4 位
+
+入口（app.py、bulk_check.py、分片 worker、bench）启动时调用一次 setup_logging(name)，
+库模块只用 logging.info(...)，不再各自 basicConfig。
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from settings import LOG_DIR, LOG_LEVEL, LOG_MASK_CARDS, LOG_SAMPLE_DEBUG, LOG_SAMPLE_INFO
+
+CARD_NUMBER_RE = re.compile(r"\d{12,}")
+
+# (card_id, 这张卡的 INFO/DEBUG 日志是否保留)
+_card_context = contextvars.ContextVar("card_log_context", default=(None, True))
+
+_listener = None
+
+
+def mask_card_numbers(text):
+    return CARD_NUMBER_RE.sub(lambda match: match.group()[:4] + "*" * (len(match.group()) - 8) + match.group()[-4:], text)
+
+
+@contextmanager
+def card_log_context():
+    """一张卡的查询范围；asyncio 任务各自有一份 context，并发查询的卡不会串号。"""
+    sampled = random.random() < LOG_SAMPLE_INFO
+    token = _card_context.set((uuid.uuid4().hex[:12], sampled))
+    try:
+        yield
+    finally:
+        _card_context.reset(token)
+
+
+def current_card_id():
+    return _card_context.get()[0]
+
+
+class CardContextFilter(logging.Filter):
+    """在调用方线程里执行：带上 card_id，并按采样结果丢掉低级别日志（丢掉的记录不会进队列）。"""
+
+    def filter(self, record):
+        card_id, sampled = _card_context.get()
+        record.card_id = card_id
+        if card_id is None or record.levelno >= logging.WARNING:
+            return True
+        if record.levelno <= logging.DEBUG:
+            return sampled and random.random() < LOG_SAMPLE_DEBUG
+        return sampled
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, mask_cards=LOG_MASK_CARDS):
+        super().__init__()
+        self.mask_cards = mask_cards
+
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": mask_card_numbers(record.getMessage()) if self.mask_cards else record.getMessage(),
+            "card_id": getattr(record, "card_id", None),
+            "process": record.process,
+        }
+        # QueueHandler.prepare 已经把异常堆栈拼进了 msg
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, mask_cards=LOG_MASK_CARDS):
+        super().__init__("%(asctime)s [%(levelname)s] %(message)s")
+        self.mask_cards = mask_cards
+
+    def format(self, record):
+        line = super().format(record)
+        if self.mask_cards:
+            line = mask_card_numbers(line)
+        card_id = getattr(record, "card_id", None)
+        return f"{line} [card {card_id}]" if card_id else line
+
+
+def setup_logging(name, level=LOG_LEVEL, log_dir=LOG_DIR):
+    """把根 logger 换成 QueueHandler，文件 <log_dir>/<name>.log 和终端由后台线程写入；重复调用不生效。"""
+    global _listener
+    if _listener is not None:
+        return _listener
+    os.makedirs(log_dir, exist_ok=True)
+    file_handler = logging.FileHandler(os.path.join(log_dir, f"{name}.log"), encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(TextFormatter())
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(CardContextFilter())
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # 退出前把队列里剩下的记录写完
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,269 @@
+"""进程内的轻量指标：Counter / Gauge / Histogram，以 Prometheus 文本格式导出。"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# 单卡各阶段通常在 10ms ~ 60s 之间
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """导出时再调用 function 取值，适合页面池占用这类随时变化的状态。"""
+        self._functions[self._key(labels)] = function
+
+    def render(self):
+        for key, function in list(self._functions.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            with self._lock:
+                self._values[key] = value
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {"counts": list(state["counts"]), "sum": state["sum"], "count": state["count"]}
+                    for key, state in self._values.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, state in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+def bucket_quantile(buckets, counts, total, q):
+    """按桶估算分位数（取所在桶的上界），与 Prometheus histogram_quantile 的精度相当。"""
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for bound, count in zip(buckets, counts):
+        cumulative += count
+        if cumulative >= rank:
+            return bound
+    return buckets[-1]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ========== 业务指标 ==========
+STAGE_SECONDS = Histogram(
+    "lulu_stage_duration_seconds",
+    "Duration of each step of the gift card check flow.",
+    ["stage"],
+)
+CHECK_RETRIES = Counter("lulu_check_retries_total", "Retries inside input_card_number_and_check.")
+CHECK_ERRORS = Counter("lulu_check_errors_total", "Failed check attempts, by failure class.", ["error"])
+CARDS_CHECKED = Counter("lulu_cards_checked_total", "Cards checked, by result.", ["result"])
+QUEUE_DEPTH = Gauge("lulu_card_queue_depth", "Cards waiting in work queues for a free worker.")
+PAGE_RECOVERIES = Counter("lulu_page_recoveries_total", "Recovery steps taken to bring a page back to the check dialog, by starting state.", ["state"])
+CONCURRENCY_LIMIT = Gauge("lulu_concurrency_limit", "Current AIMD limit on cards checked at the same time.")
+IN_FLIGHT_CHECKS = Gauge("lulu_in_flight_checks", "Cards being checked right now.")
+POOL_PAGES = Gauge("lulu_pool_pages", "Page pool pages by region and state.", ["region", "state"])
+PACING_PROFILE = Gauge("lulu_pacing_profile", "1 for the pacing profile in use.", ["profile"])
+PACING_TARGET_RATE = Gauge("lulu_pacing_target_rate_per_min", "Per-page check rate the pacing profile aims for (0 = not rate based).")
+PACING_WAIT_SECONDS = Histogram(
+    "lulu_pacing_wait_seconds",
+    "Deliberate waits added by the pacing profile, by kind.",
+    ["profile", "kind"],
+    buckets=(0.0, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0),
+)
+POOL_RECYCLES = Counter("lulu_pool_recycles_total", "Pool pages replaced proactively, by reason.", ["reason"])
+
+
+# 当前这张卡各阶段的累计耗时（ms），见 card_stage_timings
+_card_stages = contextvars.ContextVar("card_stages", default=None)
+
+
+@contextmanager
+def card_stage_timings():
+    """收集这张卡查询过程中各阶段的耗时（ms，同一阶段出现多次时累加，比如重试）。
+
+    asyncio 任务各自有一份 context，并发查询的卡互不干扰。
+    """
+    stages = {}
+    token = _card_stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _card_stages.reset(token)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = _card_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds * 1000
+
+
+@contextmanager
+def stage_timer(stage):
+    """用单调时钟计时一个阶段；async 代码里也可以直接 with stage_timer(...): await ..."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.monotonic() - started)
+
+
+def stage_summary():
+    """每个阶段的次数、平均耗时和估算的 p50/p95，用于 CLI 结束时打印。"""
+    summary = {}
+    for (stage,), state in sorted(STAGE_SECONDS.snapshot().items()):
+        count = state["count"]
+        summary[stage] = {
+            "count": count,
+            "mean_ms": round(state["sum"] / count * 1000, 1) if count else None,
+            "p50_ms_le": _bucket_ms(STAGE_SECONDS.buckets, state["counts"], count, 0.5),
+            "p95_ms_le": _bucket_ms(STAGE_SECONDS.buckets, state["counts"], count, 0.95),
+        }
+    return summary
+
+
+def _bucket_ms(buckets, counts, total, q):
+    bound = bucket_quantile(buckets, counts, total, q)
+    if bound is None:
+        return None
+    return "+Inf" if bound == math.inf else round(bound * 1000)
+
+
+def format_summary():
+    lines = ["==== 各阶段耗时 ===="]
+    for stage, stats in stage_summary().items():
+        lines.append(
+            f"{stage:<22} count={stats['count']:<6} mean={stats['mean_ms']}ms "
+            f"p50<={stats['p50_ms_le']}ms p95<={stats['p95_ms_le']}ms"
+        )
+    lines.append(f"retries={CHECK_RETRIES.value()}")
+    errors = {key[0]: value for key, value in CHECK_ERRORS.values().items()}
+    if errors:
+        lines.append(f"errors={errors}")
+    results = {key[0]: value for key, value in CARDS_CHECKED.values().items()}
+    if results:
+        lines.append(f"results={results}")
+    return "\n".join(lines)
@@ -0,0 +1,149 @@
+"""查询节奏：每张卡之前等多久、要不要模拟人的滚动和鼠标移动、打开对话框后等多久、重试退避多久。
+
+原来这些等待分散在 playwright_helpers 的各个函数里，现在由一个命名的节奏策略统一决定，
+用 LULU_PACING_PROFILE 选择，LULU_PACING_FILE（JSON）可以增加或覆盖策略：
+
+    [{"name": "gentle", "pre_input_s": [1.0, 3.0], "human_actions": true, "dialog_settle_ms": 800}]
+
+内置策略：
+    zero      不等待、不模拟人的动作、重试不退避；本地 benchmark 和冒烟测试用
+    human     原来的行为：每张卡前随机等 0.5~2 秒、查询后滚动和移动鼠标
+    measured  生产用：每个页面按 LULU_PACING_RATE_PER_MIN 的速率匀速查询（带少量抖动），不做多余的动作
+"""
+import asyncio
+import json
+import logging
+import random
+import time
+import weakref
+
+from metrics import PACING_PROFILE, PACING_TARGET_RATE, PACING_WAIT_SECONDS
+from settings import (
+    PACING_FILE,
+    PACING_PROFILE_NAME,
+    PACING_RATE_PER_MIN,
+    RETRY_BACKOFF_BASE_S,
+    RETRY_BACKOFF_CAP_S,
+)
+
+
+class PacingProfile:
+    """rate_per_min > 0 时按每个页面的速率匀速查询，pre_input_s 只在 rate_per_min 为 0 时使用。"""
+
+    def __init__(
+        self,
+        name,
+        pre_input_s=(0.0, 0.0),
+        rate_per_min=0.0,
+        rate_jitter=0.1,
+        human_actions=False,
+        dialog_settle_ms=0,
+        retry_backoff_base_s=RETRY_BACKOFF_BASE_S,
+        retry_backoff_cap_s=RETRY_BACKOFF_CAP_S,
+    ):
+        self.name = name
+        self.pre_input_s = tuple(pre_input_s)
+        self.rate_per_min = rate_per_min
+        self.rate_jitter = rate_jitter
+        self.human_actions = human_actions
+        self.dialog_settle_ms = dialog_settle_ms
+        self.retry_backoff_base_s = retry_backoff_base_s
+        self.retry_backoff_cap_s = retry_backoff_cap_s
+        # page -> 这个页面上一张卡开始查询的时间（单调时钟）
+        self._last_check = weakref.WeakKeyDictionary()
+
+    def pre_input_delay(self, page):
+        """这个页面查询下一张卡前要等的秒数。"""
+        if self.rate_per_min > 0:
+            interval = 60.0 / self.rate_per_min * random.uniform(1 - self.rate_jitter, 1 + self.rate_jitter)
+            last = self._last_check.get(page)
+            return 0.0 if last is None else max(0.0, last + interval - time.monotonic())
+        low, high = self.pre_input_s
+        return random.uniform(low, high) if high > 0 else 0.0
+
+    def retry_backoff_s(self, attempt):
+        """第 attempt 次失败后的等待时间：指数增长、封顶，再加一点抖动避免多个 worker 同时重试。"""
+        delay = min(self.retry_backoff_cap_s, self.retry_backoff_base_s * 2 ** (attempt - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "pre_input_s": list(self.pre_input_s),
+            "rate_per_min": self.rate_per_min,
+            "rate_jitter": self.rate_jitter,
+            "human_actions": self.human_actions,
+            "dialog_settle_ms": self.dialog_settle_ms,
+            "retry_backoff_base_s": self.retry_backoff_base_s,
+            "retry_backoff_cap_s": self.retry_backoff_cap_s,
+        }
+
+
+PROFILES = {}
+_active = None
+
+
+def register_profile(profile):
+    PROFILES[profile.name] = profile
+    return profile
+
+
+def load_pacing_file(path):
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    for entry in entries:
+        register_profile(PacingProfile(**entry))
+    logging.info(f"Loaded {len(entries)} pacing profiles from {path}")
+
+
+def set_profile(name):
+    """切换当前进程使用的节奏策略，返回它；名字不认识时抛 ValueError。"""
+    global _active
+    profile = PROFILES.get(name)
+    if profile is None:
+        raise ValueError(f"Unknown pacing profile '{name}', known profiles: {sorted(PROFILES)}")
+    if _active is not None:
+        PACING_PROFILE.set(0, profile=_active.name)
+    PACING_PROFILE.set(1, profile=profile.name)
+    PACING_TARGET_RATE.set(profile.rate_per_min)
+    _active = profile
+    logging.info(f"Pacing profile: {profile.as_dict()}")
+    return profile
+
+
+def active_profile():
+    return _active
+
+
+async def _wait(seconds, kind):
+    PACING_WAIT_SECONDS.observe(seconds, profile=_active.name, kind=kind)
+    if seconds > 0:
+        await asyncio.sleep(seconds)
+
+
+async def before_check(page):
+    """每张卡输入卡号之前调用一次。"""
+    await _wait(_active.pre_input_delay(page), "pre_input")
+    _active._last_check[page] = time.monotonic()
+
+
+async def before_retry(attempt):
+    await _wait(_active.retry_backoff_s(attempt), "retry")
+
+
+async def after_dialog_open(page):
+    """打开查询对话框后等页面稳定；用页面的 wait_for_timeout，页面关闭时会立即报错。"""
+    settle_ms = _active.dialog_settle_ms
+    PACING_WAIT_SECONDS.observe(settle_ms / 1000, profile=_active.name, kind="dialog_settle")
+    if settle_ms > 0:
+        await page.wait_for_timeout(settle_ms)
+
+
+# ========== 内置策略 ==========
+register_profile(PacingProfile("zero", retry_backoff_base_s=0.0, retry_backoff_cap_s=0.0))
+register_profile(PacingProfile("human", pre_input_s=(0.5, 2.0), human_actions=True, dialog_settle_ms=500))
+register_profile(PacingProfile("measured", rate_per_min=PACING_RATE_PER_MIN, dialog_settle_ms=200))
+if PACING_FILE:
+    load_pacing_file(PACING_FILE)
+
+set_profile(PACING_PROFILE_NAME)
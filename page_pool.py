@@ -0,0 +1,426 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from browser_host import BrowserHost
+from page_state import DIALOG_OPEN, ensure_dialog_open
+from playwright_helpers import close_popup, open_check_dialogue
+from playwright_init import init_driver
+from governor import GOVERNOR
+from metrics import POOL_PAGES, POOL_RECYCLES, stage_timer
+from regions import get_region
+from resource_policy import get_page_traffic
+from storage_state import storage_state_path
+from settings import (
+    BROWSER_TOPOLOGY,
+    HEADLESS,
+    POOL_LEASE_TIMEOUT_S,
+    POOL_MEMORY_CHECK_EVERY,
+    POOL_RECYCLE_AGE_S,
+    POOL_RECYCLE_CHECKS,
+    POOL_RECYCLE_MEMORY_MB,
+    POOL_SIZE,
+    WARM_REGIONS,
+)
+
+
+class PooledPage:
+    """一个已经停在查询对话框上的浏览器页面，以及它所属的 driver 对象。
+
+    host 不为 None 时页面开在共享浏览器里，关闭时只关页面（和空出来的 context），不关浏览器。
+    """
+
+    def __init__(self, slot_id, playwright, browser, context, page, host=None):
+        self.slot_id = slot_id
+        self.playwright = playwright
+        self.browser = browser
+        self.context = context
+        self.page = page
+        self.host = host
+        self.created_at = time.monotonic()
+        self.checks = 0
+        self.broken = False
+        # 回收中：替换页面正在预热；retired：替换页面已经上岗，这个页面下次回到池里时关闭
+        self.recycling = False
+        self.retired = False
+        self.memory_mb = None
+        self._cdp = None
+
+    async def measure_memory_mb(self):
+        """通过 CDP Performance.getMetrics 读取页面的 JS 堆大小（MB）。"""
+        if self._cdp is None:
+            self._cdp = await self.context.new_cdp_session(self.page)
+            await self._cdp.send("Performance.enable")
+        response = await self._cdp.send("Performance.getMetrics")
+        metrics = {metric["name"]: metric["value"] for metric in response.get("metrics", [])}
+        self.memory_mb = round(metrics.get("JSHeapTotalSize", 0) / (1024 * 1024), 1)
+        return self.memory_mb
+
+    async def close(self):
+        if self.host is not None:
+            await self.host.close_page(self.context, self.page)
+            return
+        try:
+            await self.browser.close()
+            await self.playwright.stop()
+        except Exception as e:
+            logging.error(f"Pool slot {self.slot_id} failed to close browser: {e}")
+
+
+class PagePool:
+    """常驻的预热页面池，页面都停在礼品卡查询对话框上。
+
+    每次借出一个页面查一张卡，click_check_another_card 之后归还。借出前先用页面状态机把页面
+    带回查询对话框；这样恢复不了、或者调用方标记为坏掉的页面才关闭，并在后台换一个新的。
+
+    每个池对应一个地区（regions.Region）：网址、浏览器 locale/时区和选择器都来自它；url 参数
+    可以覆盖地区的网址，比如指向本地的 mock 站点。
+
+    健康的页面也会主动轮换：查满 POOL_RECYCLE_CHECKS 张卡、存活超过 POOL_RECYCLE_AGE_S 秒，
+    或者 JS 堆（每 POOL_MEMORY_CHECK_EVERY 张卡通过 CDP 量一次）超过 POOL_RECYCLE_MEMORY_MB 时。
+    替换页面在后台预热，旧页面在此期间照常接单，所以轮换不会卡住借出。
+
+    传入 host（BrowserHost）时页面都开在同一个共享浏览器里，而不是每个页面一个浏览器；
+    shared 拓扑下没有传 host 时，池自己启动并持有一个。
+    """
+
+    def __init__(self, size=POOL_SIZE, url=None, headless=HEADLESS, region=None, host=None):
+        self.size = size
+        self.region = region or get_region()
+        self.url = url or self.region.url
+        self.selectors = self.region.selectors
+        # 覆盖了 URL（比如本地模拟站点）时不读写地区的状态文件，免得混进别的站点的 cookie
+        self.storage_state_path = storage_state_path(self.region.code) if self.url == self.region.url else None
+        self.headless = headless
+        self.host = host
+        self._owns_host = False
+        self._idle = None
+        self._slots = {}
+        self._recovering = set()
+        self._retiring = set()
+        self._leased = 0
+        self._tasks = set()
+        self._closed = False
+
+    @property
+    def idle_count(self):
+        return self._idle.qsize() if self._idle else 0
+
+    @property
+    def in_use_count(self):
+        return self._leased
+
+    async def start(self):
+        if self.host is None and BROWSER_TOPOLOGY == "shared":
+            self.host = BrowserHost(headless=self.headless)
+            self._owns_host = True
+        self._idle = asyncio.Queue()
+        region = self.region.code
+        POOL_PAGES.set_function(lambda: self.idle_count, state="idle", region=region)
+        POOL_PAGES.set_function(lambda: self.in_use_count, state="in_use", region=region)
+        POOL_PAGES.set_function(lambda: len(self._recovering), state="recovering", region=region)
+        POOL_PAGES.set_function(lambda: len(self._retiring), state="recycling", region=region)
+        slots = await asyncio.gather(
+            *(self._create_slot(slot_id) for slot_id in range(1, self.size + 1)),
+            return_exceptions=True,
+        )
+        for slot_id, slot in enumerate(slots, start=1):
+            if isinstance(slot, Exception):
+                logging.error(f"Pool slot {slot_id} failed to warm up: {slot}")
+                self._schedule_recovery(slot_id)
+            else:
+                self._idle.put_nowait(slot)
+        logging.info(f"Page pool {self.region.code} started with {self.idle_count}/{self.size} warm pages")
+
+    async def _create_slot(self, slot_id):
+        with stage_timer("init_driver"):
+            if self.host is not None:
+                context, page = await self.host.new_page(
+                    self.region.locale, self.region.timezone, self.storage_state_path
+                )
+                slot = PooledPage(slot_id, self.host.playwright, self.host.browser, context, page, host=self.host)
+            else:
+                playwright, browser, context, page = await init_driver(
+                    headless=self.headless,
+                    locale=self.region.locale,
+                    timezone=self.region.timezone,
+                    storage_state_path=self.storage_state_path,
+                )
+                slot = PooledPage(slot_id, playwright, browser, context, page)
+        self._slots[slot_id] = slot
+        try:
+            with stage_timer("goto"):
+                await page.goto(self.url)
+            with stage_timer("close_popup"):
+                await close_popup(page, self.selectors)
+            with stage_timer("open_check_dialogue"):
+                await open_check_dialogue(page, self.selectors)
+        except Exception:
+            await slot.close()
+            self._slots.pop(slot_id, None)
+            raise
+        logging.info(f"Pool {self.region.code} slot {slot_id} is warm")
+        return slot
+
+    async def is_healthy(self, slot):
+        """页面不在查询对话框上时先就地恢复（点击/重新打开/重新加载），恢复不了才算不健康。"""
+        if slot.broken or slot.page.is_closed():
+            return False
+        state = await ensure_dialog_open(slot.page, self.url, self.selectors)
+        if state != DIALOG_OPEN:
+            logging.warning(f"Pool slot {slot.slot_id} failed health check, page state is {state}")
+            return False
+        return True
+
+    async def replace(self, slot):
+        """关闭坏掉的页面并重新预热一个新的页面。"""
+        self._slots.pop(slot.slot_id, None)
+        await slot.close()
+        return await self._create_slot(slot.slot_id)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _schedule_recovery(self, slot_id, slot=None):
+        self._recovering.add(slot_id)
+        self._spawn(self._recover(slot_id, slot))
+
+    async def _recover(self, slot_id, slot):
+        delay = 1.0
+        try:
+            while not self._closed:
+                try:
+                    if slot is not None:
+                        new_slot = await self.replace(slot)
+                    else:
+                        new_slot = await self._create_slot(slot_id)
+                    self._idle.put_nowait(new_slot)
+                    return
+                except Exception as e:
+                    slot = None
+                    logging.error(f"Pool slot {slot_id} failed to recover: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30.0)
+        finally:
+            self._recovering.discard(slot_id)
+
+    def _replace_broken(self, slot):
+        slot.broken = True
+        if slot.recycling:
+            # 替换页面已经在预热，只需要关掉这个
+            self._spawn(self._retire(slot))
+        else:
+            self._schedule_recovery(slot.slot_id, slot)
+
+    def _recycle_reason(self, slot):
+        if POOL_RECYCLE_CHECKS > 0 and slot.checks >= POOL_RECYCLE_CHECKS:
+            return "checks"
+        if POOL_RECYCLE_AGE_S > 0 and time.monotonic() - slot.created_at >= POOL_RECYCLE_AGE_S:
+            return "age"
+        return None
+
+    def _start_recycle(self, slot, reason):
+        slot.recycling = True
+        self._retiring.add(slot)
+        if slot.host is not None:
+            # 共享浏览器里新页面不再放进这个 context，旧页面都退役后 context 随之关闭
+            slot.host.drain(slot.context)
+        logging.info(f"Pool {self.region.code} slot {slot.slot_id} recycling ({reason}) after {slot.checks} checks")
+        self._spawn(self._recycle(slot, reason))
+
+    async def _recycle(self, slot, reason):
+        """先预热替换页面，成功后才让旧页面退役；旧页面在此期间照常接单。"""
+        try:
+            new_slot = await self._create_slot(slot.slot_id)
+        except Exception as e:
+            if slot.broken:
+                # 旧页面在预热期间坏掉并已关闭，交给常规恢复
+                self._schedule_recovery(slot.slot_id)
+                return
+            # _create_slot 失败时会把 slot_id 从 _slots 里删掉，旧页面还在用，放回去
+            self._slots[slot.slot_id] = slot
+            self._retiring.discard(slot)
+            slot.recycling = False
+            slot.created_at = time.monotonic()
+            logging.error(f"Pool slot {slot.slot_id} failed to warm a replacement, keeping the old page: {e}")
+            return
+        POOL_RECYCLES.inc(reason=reason)
+        slot.retired = True
+        # 旧页面空闲就直接从队列里取出关闭，正在用的等 release 时关闭
+        idle = [self._idle.get_nowait() for _ in range(self._idle.qsize())]
+        for idle_slot in idle:
+            if idle_slot is slot:
+                self._spawn(self._retire(slot))
+            else:
+                self._idle.put_nowait(idle_slot)
+        self._idle.put_nowait(new_slot)
+
+    async def _retire(self, slot):
+        try:
+            await slot.close()
+        finally:
+            self._retiring.discard(slot)
+
+    async def _check_memory(self, slot):
+        try:
+            memory_mb = await slot.measure_memory_mb()
+        except Exception as e:
+            logging.debug(f"Pool slot {slot.slot_id} memory check failed: {e}")
+            return
+        if memory_mb >= POOL_RECYCLE_MEMORY_MB and not (slot.recycling or slot.broken or self._closed):
+            self._start_recycle(slot, "memory")
+
+    def release(self, slot, broken=False):
+        if self._closed:
+            self._spawn(slot.close())
+            return
+        if slot.retired:
+            self._spawn(self._retire(slot))
+            return
+        if broken or slot.broken:
+            logging.warning(f"Pool slot {slot.slot_id} returned broken, replacing it")
+            self._replace_broken(slot)
+            return
+        self._idle.put_nowait(slot)
+        if slot.recycling:
+            return
+        reason = self._recycle_reason(slot)
+        if reason is not None:
+            self._start_recycle(slot, reason)
+        elif POOL_RECYCLE_MEMORY_MB > 0 and POOL_MEMORY_CHECK_EVERY > 0 and slot.checks % POOL_MEMORY_CHECK_EVERY == 0:
+            self._spawn(self._check_memory(slot))
+
+    async def _take_idle(self, timeout):
+        """从空闲队列取一个页面；超时或被取消时，如果页面已经取到了就放回去，不会丢。"""
+        getter = asyncio.ensure_future(self._idle.get())
+        try:
+            return await asyncio.wait_for(asyncio.shield(getter), timeout=timeout)
+        except BaseException:
+            if not getter.cancel() and not getter.cancelled() and getter.exception() is None:
+                # 取到页面的同时超时或被取消
+                self._idle.put_nowait(getter.result())
+            raise
+
+    @asynccontextmanager
+    async def lease(self, timeout=POOL_LEASE_TIMEOUT_S):
+        if self._closed:
+            raise RuntimeError("Page pool is closed")
+        while True:
+            # pool_lease 只算等空闲页面的时间；健康检查里的恢复由状态机计入 recover，两者不重叠
+            with stage_timer("pool_lease"):
+                slot = await self._take_idle(timeout)
+            try:
+                healthy = await self.is_healthy(slot)
+            except BaseException:
+                # 健康检查可能正在重新加载页面，调用方被取消（请求超时、流式客户端断开、任务取消）时
+                # 页面还没有交给调用方，放回池里，下一次租用时状态机会再把它带回输入框
+                self.release(slot)
+                raise
+            if healthy:
+                break
+            self._replace_broken(slot)
+
+        self._leased += 1
+        try:
+            yield slot
+        except Exception:
+            slot.broken = True
+            raise
+        finally:
+            self._leased -= 1
+            slot.checks += 1
+            self.release(slot)
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "region": self.region.code,
+            "url": self.url,
+            "size": self.size,
+            "idle": self.idle_count,
+            "in_use": self.in_use_count,
+            "recovering": len(self._recovering),
+            "recycling": len(self._retiring),
+            "recycle_policy": {"checks": POOL_RECYCLE_CHECKS, "age_s": POOL_RECYCLE_AGE_S, "memory_mb": POOL_RECYCLE_MEMORY_MB},
+            "pages": [
+                {
+                    "slot_id": slot.slot_id,
+                    "checks": slot.checks,
+                    "age_s": round(now - slot.created_at, 1),
+                    "memory_mb": slot.memory_mb,
+                    "traffic": get_page_traffic(slot.page),
+                }
+                for slot in sorted(self._slots.values(), key=lambda slot: slot.slot_id)
+            ],
+        }
+
+    async def close(self):
+        self._closed = True
+        for task in list(self._tasks):
+            task.cancel()
+        slots = list(self._slots.values()) + [slot for slot in self._retiring if slot not in self._slots.values()]
+        self._slots.clear()
+        self._retiring.clear()
+        await asyncio.gather(*(slot.close() for slot in slots))
+        if self._owns_host:
+            await self.host.close()
+        logging.info(f"Page pool {self.region.code} closed")
+
+
+class RegionPools:
+    """每个地区一个 PagePool。WARM_REGIONS 在 start 时预热，其他地区第一次有卡时才启动。"""
+
+    def __init__(self, size=POOL_SIZE, headless=HEADLESS, warm_regions=WARM_REGIONS):
+        self.size = size
+        self.headless = headless
+        self.warm_regions = warm_regions
+        # shared 拓扑下所有地区的页面池共用一个浏览器
+        self.host = BrowserHost(headless=headless) if BROWSER_TOPOLOGY == "shared" else None
+        self._pools = {}
+        self._starting = {}
+
+    @property
+    def pools(self):
+        return dict(self._pools)
+
+    async def start(self):
+        await asyncio.gather(*(self.get(get_region(code)) for code in self.warm_regions))
+
+    async def get(self, region):
+        """返回 region 的页面池，还没启动时启动它；同时到达的调用共用同一次启动。"""
+        pool = self._pools.get(region.code)
+        if pool is not None:
+            return pool
+        starting = self._starting.get(region.code)
+        if starting is None:
+            starting = asyncio.ensure_future(self._start_pool(region))
+            self._starting[region.code] = starting
+        return await asyncio.shield(starting)
+
+    async def _start_pool(self, region):
+        try:
+            pool = PagePool(size=self.size, headless=self.headless, region=region, host=self.host)
+            await pool.start()
+            if self._pools:
+                # 多一个地区就多一组页面，并发上限跟着放开，各地区才能真正并行
+                GOVERNOR.raise_max_limit(pool.size)
+            self._pools[region.code] = pool
+            return pool
+        finally:
+            self._starting.pop(region.code, None)
+
+    def stats(self):
+        return {code: pool.stats() for code, pool in sorted(self._pools.items())}
+
+    def browser_stats(self):
+        return self.host.stats() if self.host is not None else {"topology": "per_page"}
+
+    async def close(self):
+        pools = list(self._pools.values())
+        self._pools.clear()
+        await asyncio.gather(*(pool.close() for pool in pools))
+        if self.host is not None:
+            await self.host.close()
@@ -0,0 +1,89 @@
+"""查询页面的状态机：每张卡查询前先确认页面停在输入框上，不在时走最便宜的路径回去。
+
+状态转换（括号里是动作）：
+    landing         --(close_popup)--------------> popup_dismissed
+    popup_dismissed --(open_check_dialogue)------> dialog_open
+    result_shown    --(click_check_another_card)-> dialog_open
+    error           --(goto 查询页面)------------> landing / popup_dismissed
+"""
+import logging
+
+from metrics import PAGE_RECOVERIES, stage_timer
+from playwright_helpers import click_check_another_card, close_popup, open_check_dialogue
+from regions import DEFAULT_SELECTORS
+from settings import GIFT_CARD_URL
+
+LANDING = "landing"
+POPUP_DISMISSED = "popup_dismissed"
+DIALOG_OPEN = "dialog_open"
+RESULT_SHOWN = "result_shown"
+ERROR = "error"
+
+# 一次 evaluate 判断当前状态，顺序很重要：弹窗会挡住下面所有元素
+# 参数是地区的选择器（Selectors.as_dict()）
+DETECT_STATE_JS = """(selectors) => {
+    const visible = (el) => !!el && el.getClientRects().length > 0 && getComputedStyle(el).visibility !== "hidden";
+    const byXPath = (xpath) => document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    const modal = byXPath(selectors.popup_modal);
+    if (visible(modal) && modal.getAttribute("aria-hidden") !== "true") {
+        return "landing";
+    }
+    if (visible(byXPath(selectors.card_input))) {
+        return "dialog_open";
+    }
+    if (visible(byXPath(selectors.check_another))) {
+        return "result_shown";
+    }
+    if (visible(byXPath(selectors.open_dialog))) {
+        return "popup_dismissed";
+    }
+    return "error";
+}"""
+
+
+async def detect_page_state(page, selectors=DEFAULT_SELECTORS):
+    if page.is_closed():
+        return ERROR
+    try:
+        return await page.evaluate(DETECT_STATE_JS, selectors.as_dict())
+    except Exception as e:
+        logging.warning(f"检测页面状态失败: {e}")
+        return ERROR
+
+
+async def ensure_dialog_open(page, url=GIFT_CARD_URL, selectors=DEFAULT_SELECTORS, max_steps=5):
+    """把页面带回 dialog_open，返回最终状态；最多重新加载一次页面，仍然不行就交给调用方换页面。"""
+    state = await detect_page_state(page, selectors)
+    if state == DIALOG_OPEN:
+        return state
+
+    reloaded = False
+    with stage_timer("recover"):
+        for _ in range(max_steps):
+            if state == DIALOG_OPEN or page.is_closed():
+                break
+            if state == ERROR and reloaded:
+                break
+            PAGE_RECOVERIES.inc(state=state)
+            logging.info(f"页面当前状态为 {state}，尝试恢复到 {DIALOG_OPEN}")
+            try:
+                if state == LANDING:
+                    await close_popup(page, selectors)
+                elif state == POPUP_DISMISSED:
+                    await open_check_dialogue(page, selectors)
+                elif state == RESULT_SHOWN:
+                    await click_check_another_card(page, selectors)
+                else:
+                    reloaded = True
+                    await page.goto(url)
+            except Exception as e:
+                logging.warning(f"从 {state} 恢复页面失败: {e}")
+                if reloaded:
+                    break
+                state = ERROR
+                continue
+            state = await detect_page_state(page, selectors)
+
+    if state != DIALOG_OPEN:
+        logging.error(f"页面无法恢复到 {DIALOG_OPEN}，当前状态 {state}")
+    return state
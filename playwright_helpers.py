@@ -1,9 +1,23 @@
-import asyncio
+import html
+import json
 import random
+import re
 import logging
-import os
 from pathlib import Path
 from playwright.async_api import async_playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from metrics import CHECK_ERRORS, CHECK_RETRIES, observe_stage, stage_timer
+from regions import DEFAULT_SELECTORS, xpath
+import pacing
+from storage_state import refresh_storage_state
+from settings import (
+    BALANCE_RESPONSE_PATTERN,
+    BLOCKED_PATTERN,
+    CHECK_MAX_ATTEMPTS,
+    CHECK_MODE,
+    CHECK_RESULT_TIMEOUT_MS,
+    INVALID_CARD_PATTERN,
+)
 
 try:
     from playwright_stealth import stealth_async
@@ -11,102 +25,366 @@ try:
 except ImportError:
     USE_STEALTH = False
 
-log_dir = "../log"
-os.makedirs(log_dir, exist_ok=True)
+BALANCE_RESPONSE_RE = re.compile(BALANCE_RESPONSE_PATTERN, re.IGNORECASE)
+BALANCE_HTML_RE = re.compile(r'<p[^>]*class="balance"[^>]*>(.*?)</p>', re.IGNORECASE | re.DOTALL)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler("../log/playwright_helper.log"), logging.StreamHandler()],
-)
+# ========== 查询结果分类 ==========
+BALANCE_FOUND = "balance_found"
+INVALID_CARD = "invalid_card"
+TRANSIENT_TIMEOUT = "transient_timeout"
+PAGE_DESYNC = "page_desync"
+BLOCKED = "blocked"
+RETRYABLE_OUTCOMES = {TRANSIENT_TIMEOUT}
+
+INVALID_CARD_RE = re.compile(INVALID_CARD_PATTERN, re.IGNORECASE)
+BLOCKED_RE = re.compile(BLOCKED_PATTERN, re.IGNORECASE)
+
+# 在页面里轮询，一旦出现余额、错误提示或拦截页就返回
+CHECK_RESULT_JS = """([balanceXPath, errorSelector]) => {
+    const visible = (el) => !!el && el.getClientRects().length > 0 && getComputedStyle(el).visibility !== "hidden";
+    const text = (el) => (el.innerText || el.textContent || "").trim();
+    const balance = document.evaluate(balanceXPath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (visible(balance) && text(balance)) {
+        return {kind: "balance", text: text(balance)};
+    }
+    for (const el of document.querySelectorAll(errorSelector)) {
+        if (visible(el) && text(el)) {
+            return {kind: "error", text: text(el)};
+        }
+    }
+    if (/access denied|too many requests|captcha/i.test(document.title)) {
+        return {kind: "blocked", text: document.title};
+    }
+    return null;
+}"""
+
+# inpage 模式：填卡号、点查询、等结果、点 CHECK ANOTHER CARD 都在一次 evaluate 里完成，
+# 每张卡只有一次 Python <-> 浏览器往返；时间用 performance.now() 在页面里计
+CHECK_IN_PAGE_JS = """async ({selectors, cardNumber, timeoutMs, resetTimeoutMs}) => {
+    const visible = (el) => !!el && el.getClientRects().length > 0 && getComputedStyle(el).visibility !== "hidden";
+    const byXPath = (xpath) => document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+    const readResult = (__CHECK_RESULT_JS__);
+    const timings = {input_ms: null, balance_wait_ms: null, reset_ms: null};
+
+    let started = performance.now();
+    const input = byXPath(selectors.card_input);
+    const button = byXPath(selectors.check_button);
+    if (!visible(input) || !button) {
+        return {kind: "desync", text: "card number input is not visible", timings};
+    }
+    input.focus();
+    // 用原生 setter 赋值再派发事件，页面框架才会感知到输入
+    Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, "value").set.call(input, cardNumber);
+    input.dispatchEvent(new Event("input", {bubbles: true}));
+    input.dispatchEvent(new Event("change", {bubbles: true}));
+    button.click();
+    timings.input_ms = performance.now() - started;
+
+    started = performance.now();
+    let result = readResult([selectors.balance, selectors.error_css]);
+    while (!result && performance.now() - started < timeoutMs) {
+        await sleep(50);
+        result = readResult([selectors.balance, selectors.error_css]);
+    }
+    timings.balance_wait_ms = performance.now() - started;
+    if (!result) {
+        return {kind: "timeout", text: `no result within ${timeoutMs}ms`, timings};
+    }
+    if (result.kind !== "balance") {
+        return {...result, timings};
+    }
+
+    started = performance.now();
+    const again = byXPath(selectors.check_another);
+    if (visible(again)) {
+        again.click();
+        while (performance.now() - started < resetTimeoutMs) {
+            if (visible(byXPath(selectors.card_input))) {
+                timings.reset_ms = performance.now() - started;
+                break;
+            }
+            await sleep(50);
+        }
+    }
+    return {...result, timings};
+}""".replace("__CHECK_RESULT_JS__", CHECK_RESULT_JS)
+
+
+class CheckFailure(Exception):
+    """带分类的查询失败，outcome 取上面的常量之一。"""
+
+    def __init__(self, outcome, message=None):
+        super().__init__(message or outcome)
+        self.outcome = outcome
+        self.message = message
+
+
+def classify_message(message):
+    """把页面或接口给出的错误提示归类，认不出来的按暂时性失败处理。"""
+    if message and BLOCKED_RE.search(message):
+        return BLOCKED
+    if message and INVALID_CARD_RE.search(message):
+        return INVALID_CARD
+    return TRANSIENT_TIMEOUT
+
+
+def check_outcome(outcome, attempts, balance=None, message=None, timings=None, reset=False):
+    """reset=True 表示页面已经回到输入框（inpage 模式在页面里顺手做了），调用方不用再点 CHECK ANOTHER CARD。"""
+    return {
+        "balance": balance,
+        "outcome": outcome,
+        "attempts": attempts,
+        "message": message,
+        "timings": timings,
+        "reset": reset,
+    }
 
-def random_delay(min_seconds=1.0, max_seconds=3.0):
-    return random.uniform(min_seconds, max_seconds)
 
-async def close_popup(page):
-    popup_button = await page.query_selector('xpath=//*[@id="countrySelectorModal"]/div/div/div[1]/button')
+async def close_popup(page, selectors=DEFAULT_SELECTORS):
+    popup_button = await page.query_selector(xpath(selectors.popup_close))
     if popup_button:
         await popup_button.click()
 
         # 使用 wait_for_function 检查弹窗是否隐藏
         try:
             await page.wait_for_function(
-                '''() => {
-                    const modal = document.querySelector("#countrySelectorModal");
+                '''(modalXPath) => {
+                    const modal = document.evaluate(modalXPath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
                     return modal === null || modal.getAttribute("aria-hidden") === "true" || modal.style.display === "none";
                 }''',
+                arg=selectors.popup_modal,
                 timeout=5000
             )
             logging.info("已关闭弹出的欢迎对话框")
+            # 弹窗又出现了，说明保存的状态缺失或过期，用关掉弹窗后的状态覆盖它
+            await refresh_storage_state(page)
         except Exception as e:
             logging.error(f"等待弹窗隐藏时发生错误: {e}")
 
 
 async def human_like_actions(page):
-    # delay = random_delay(0.5, 2.0)
-    # await asyncio.sleep(delay)
+    """滚动和移动鼠标；当前节奏策略不需要时什么都不做（见 pacing.py）。"""
+    if not pacing.active_profile().human_actions:
+        return
 
     scroll_distance = random.randint(100, 1000)
     await page.mouse.wheel(0, scroll_distance)
 
-    # await asyncio.sleep(random_delay(0.5, 2.0))
-
     page_width = page.viewport_size["width"]
     page_height = page.viewport_size["height"]
     x = random.randint(0, page_width)
     y = random.randint(0, page_height)
     await page.mouse.move(x, y, steps=random.randint(5, 15))
 
-async def open_check_dialogue(page):
+async def open_check_dialogue(page, selectors=DEFAULT_SELECTORS):
     try:
         specific_option = await page.wait_for_selector(
-            "xpath=/html/body/div[1]/div[3]/div[2]/a", timeout=10000
+            xpath(selectors.open_dialog), timeout=10000
         )
         if specific_option:
             await specific_option.click()
             logging.info("成功点击指定选项")
-            await page.wait_for_timeout(500)  # 等待页面稳定
+            await pacing.after_dialog_open(page)  # 等待页面稳定
     except Exception as e:
         logging.warning(f"未找到指定选项或点击失败: {e}")
         logging.info("已保存截图 'open_check_dialogue_error.png' 以供调试")
 
-async def input_card_number_and_check(page, card_number, max_retries=8):
-    delay = random_delay(0.5, 2.0)
-    await asyncio.sleep(delay)
-    retry_count = 0
-    while retry_count < max_retries:
+# 余额接口里表示余额的字段，按优先级排列（小写比较）；balanceCurrency、checkBalanceUrl 这类字段不算
+BALANCE_KEYS = (
+    "formattedbalance",
+    "balanceformatted",
+    "displaybalance",
+    "balance",
+    "availablebalance",
+    "currentbalance",
+    "remainingbalance",
+    "cardbalance",
+    "giftcardbalance",
+    "balanceamount",
+)
+# 余额字段是对象时（{"amount": 12.5, "currency": "AUD"}），里面表示金额的字段
+BALANCE_AMOUNT_KEYS = ("formatted", "formattedamount", "displayvalue", "amount", "value")
+# 金额形状的字符串：数字前后最多带几个字符的货币符号或代码，例如 "$12.50"、"A$1,000.00"、"12.50 AUD"
+BALANCE_VALUE_RE = re.compile(r"^[^\d]{0,4}\s?\d[\d,.\s]*\s?[^\d]{0,4}$")
+
+def _balance_value(value):
+    """数字或金额形状的字符串才算余额，其余（币种代码、URL 等）返回 None。"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, str) and BALANCE_VALUE_RE.match(value.strip()):
+        return value.strip()
+    if isinstance(value, dict):
+        amounts = {key.lower(): item for key, item in value.items()}
+        for key in BALANCE_AMOUNT_KEYS:
+            found = _balance_value(amounts.get(key))
+            if found is not None:
+                return found
+    return None
+
+def find_balance_in_payload(payload):
+    """在余额接口返回的 JSON 里找余额字段：只认 BALANCE_KEYS 里的字段，优先使用已经格式化好的金额字符串。"""
+    candidates = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                priority = BALANCE_KEYS.index(key.lower()) if key.lower() in BALANCE_KEYS else None
+                found = _balance_value(value) if priority is not None else None
+                if found is not None:
+                    candidates.append((priority, found))
+                else:
+                    walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(payload)
+    if not candidates:
+        return None
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+def parse_error_response(body):
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return body.strip()[:200] or None
+    if isinstance(payload, dict):
+        for key in ("error", "message", "errorMessage", "detail"):
+            if isinstance(payload.get(key), str):
+                return payload[key]
+    return None
+
+def parse_balance_response(body):
+    try:
+        return find_balance_in_payload(json.loads(body))
+    except ValueError:
+        # 有的站点返回的是渲染好的 HTML 片段
+        match = BALANCE_HTML_RE.search(body)
+        return html.unescape(match.group(1)).strip() if match else None
+
+async def read_balance_from_dom(page, selectors=DEFAULT_SELECTORS):
+    """等待页面给出结果：余额、错误提示或拦截页，不再只盯着 p.balance 空等超时。"""
+    handle = await page.wait_for_function(
+        CHECK_RESULT_JS, arg=[selectors.balance, selectors.error_css], timeout=CHECK_RESULT_TIMEOUT_MS
+    )
+    state = await handle.json_value()
+    if state["kind"] == "balance":
+        return state["text"]
+    if state["kind"] == "blocked":
+        raise CheckFailure(BLOCKED, state["text"])
+    raise CheckFailure(classify_message(state["text"]), state["text"])
+
+async def read_balance_from_response(page, selectors=DEFAULT_SELECTORS):
+    """点击查询按钮并直接从余额接口的响应里解析余额，不等待页面渲染。"""
+    async with page.expect_response(
+        lambda response: BALANCE_RESPONSE_RE.search(response.url) is not None, timeout=CHECK_RESULT_TIMEOUT_MS
+    ) as response_info:
+        await page.click(xpath(selectors.check_button))
+    response = await response_info.value
+    body = await response.text()
+    if response.status in (403, 429):
+        raise CheckFailure(BLOCKED, f"HTTP {response.status}")
+    if response.status >= 500:
+        raise CheckFailure(TRANSIENT_TIMEOUT, f"HTTP {response.status}")
+    if response.status >= 400:
+        # 4xx 基本都是卡号本身的问题，只有提示里明确是被拦截时才归为 blocked
+        message = parse_error_response(body) or f"HTTP {response.status}"
+        outcome = classify_message(message)
+        raise CheckFailure(BLOCKED if outcome == BLOCKED else INVALID_CARD, message)
+    return parse_balance_response(body)
+
+async def check_in_page(page, card_number, selectors=DEFAULT_SELECTORS, reset_timeout_ms=8000):
+    """一次 page.evaluate 完成输入、查询、等待结果和复位，返回 (余额, 页面里测得的各步耗时 ms)。"""
+    state = await page.evaluate(CHECK_IN_PAGE_JS, {
+        "selectors": selectors.as_dict(),
+        "cardNumber": card_number,
+        "timeoutMs": CHECK_RESULT_TIMEOUT_MS,
+        "resetTimeoutMs": reset_timeout_ms,
+    })
+    timings = {name: round(ms, 1) for name, ms in state["timings"].items() if ms is not None}
+    # 页面里测得的耗时也计入各阶段直方图，和 dom/response 模式可以直接对比
+    for stage, name in (("input", "input_ms"), ("balance_wait", "balance_wait_ms"), ("reset", "reset_ms")):
+        if name in timings:
+            observe_stage(stage, timings[name] / 1000)
+    if state["kind"] == "balance":
+        return state["text"], timings
+    if state["kind"] == "desync":
+        raise CheckFailure(PAGE_DESYNC, state["text"])
+    if state["kind"] == "timeout":
+        raise CheckFailure(TRANSIENT_TIMEOUT, state["text"])
+    if state["kind"] == "blocked":
+        raise CheckFailure(BLOCKED, state["text"])
+    raise CheckFailure(classify_message(state["text"]), state["text"])
+
+async def input_card_number_and_check(page, card_number, max_retries=None, mode=None, selectors=DEFAULT_SELECTORS):
+    """查询一张卡，返回 {"balance", "outcome", "attempts", "message", "timings", "reset"}。
+
+    只有 transient_timeout 会重试；无效卡、页面状态错乱和被拦截都立即返回，
+    由调用方决定是否恢复页面或换一个页面。mode 为 inpage 时整个查询在页面里一次完成（见 check_in_page）。
+    """
+    mode = mode or CHECK_MODE
+    max_retries = max_retries or CHECK_MAX_ATTEMPTS
+    with stage_timer("pre_input_sleep"):
+        await pacing.before_check(page)
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            await page.fill('//*[@id="card-number"]', "")
-            await page.fill('//*[@id="card-number"]', card_number, timeout=5000)
-            logging.info(f"已输入卡号: {card_number}")
+            if mode == "inpage":
+                with stage_timer("inpage_roundtrip"):
+                    balance_text, timings = await check_in_page(page, card_number, selectors)
+                logging.info(f"查询结果: {balance_text}，页面内耗时 {timings}")
+                return check_outcome(
+                    BALANCE_FOUND, attempt, balance=balance_text, timings=timings, reset="reset_ms" in timings
+                )
 
-            await page.click('//button[@value="check-balance"]')
-            logging.info("已点击查询按钮，等待余额信息")
+            with stage_timer("input"):
+                if not await page.is_visible(xpath(selectors.card_input)):
+                    raise CheckFailure(PAGE_DESYNC, "card number input is not visible")
+                await page.fill(xpath(selectors.card_input), card_number, timeout=5000)
+                logging.info(f"已输入卡号: {card_number}")
+                if mode != "response":
+                    await page.click(xpath(selectors.check_button))
+                    logging.info("已点击查询按钮，等待余额信息")
 
-            selector = await page.query_selector('xpath=//p[@class="balance"]')
-            await selector.is_visible()
+            with stage_timer("balance_wait"):
+                if mode == "response":
+                    balance_text = await read_balance_from_response(page, selectors)
+                    if balance_text is None:
+                        logging.warning("余额接口的响应里没有找到余额，改为从页面读取")
+                        balance_text = await read_balance_from_dom(page, selectors)
+                else:
+                    balance_text = await read_balance_from_dom(page, selectors)
 
-            balance_element = await page.wait_for_selector('xpath=//p[@class="balance"]', timeout=5000)
-            if balance_element:
-                balance_text = await balance_element.inner_text()
-                logging.info(f"查询结果: {balance_text}")
-                return balance_text
+            logging.info(f"查询结果: {balance_text}")
+            return check_outcome(BALANCE_FOUND, attempt, balance=balance_text)
+        except CheckFailure as e:
+            outcome, message = e.outcome, e.message
+        except PlaywrightTimeoutError as e:
+            outcome, message = TRANSIENT_TIMEOUT, str(e).splitlines()[0]
         except Exception as e:
-            retry_count += 1
-            logging.warning(f"查询卡号 {card_number} 时失败: {e}")
-            if retry_count < max_retries:
-                await asyncio.sleep(random.uniform(0.5, 1.0))
-            else:
-                logging.error(f"卡号 {card_number} 查询失败，已达到最大重试次数")
-                return "Error"
+            # 页面被关闭、导航中断这类异常说明页面已经不在预期状态
+            outcome, message = PAGE_DESYNC, f"{type(e).__name__}: {e}"
+        CHECK_ERRORS.inc(error=outcome)
+        logging.warning(f"查询卡号 {card_number} 失败 ({outcome}): {message}")
+        if outcome not in RETRYABLE_OUTCOMES:
+            return check_outcome(outcome, attempt, message=message)
+        if attempt >= max_retries:
+            logging.error(f"卡号 {card_number} 查询失败，已达到最大重试次数")
+            return check_outcome(outcome, attempt, message=message)
+        CHECK_RETRIES.inc()
+        await pacing.before_retry(attempt)
 
 
-async def click_check_another_card(page):
+async def click_check_another_card(page, selectors=DEFAULT_SELECTORS):
     try:
-        continue_button = await page.wait_for_selector('//button[contains(text(), "CHECK ANOTHER CARD")]', timeout=8000)
+        continue_button = await page.wait_for_selector(xpath(selectors.check_another), timeout=8000)
         if continue_button:
             await continue_button.click()
             logging.info("已点击 'CHECK ANOTHER CARD' 按钮")
-            await page.wait_for_selector('xpath=//*[@id="card-number"]', timeout=8000)
+            await page.wait_for_selector(xpath(selectors.card_input), timeout=8000)
     except Exception as e:
         logging.error(f"未找到 'CHECK ANOTHER CARD' 按钮或点击失败: {e}")
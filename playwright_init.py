@@ -1,9 +1,10 @@
 import asyncio
 import random
 import logging
-import os
 from pathlib import Path
 from playwright.async_api import async_playwright
+from resource_policy import DEFAULT_POLICY, apply_resource_policy
+from storage_state import load_storage_state, track_page
 
 try:
     from playwright_stealth import stealth_async
@@ -11,114 +12,123 @@ try:
 except ImportError:
     USE_STEALTH = False
 
-log_dir = "../log"
-os.makedirs(log_dir, exist_ok=True)
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.1 Safari/605.1.15",
+]
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler("../log/playwright_helper.log"), logging.StreamHandler()],
-)
+LAUNCH_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--disable-web-security",
+    "--disable-features=IsolateOrigins,site-per-process",
+    "--no-sandbox",
+    "--disable-setuid-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--enable-webgl",
+    "--ignore-certificate-errors",
+    "--allow-running-insecure-content",
+    "--disable-popup-blocking",
+    "--disable-features=script-streaming",
+    "--disable-extensions",
+    "--mute-audio",
+    "--disable-background-networking",
+    "--disable-background-timer-throttling",
+    "--disable-backgrounding-occluded-windows",
+    "--disable-breakpad",
+    "--disable-client-side-phishing-detection",
+]
 
-async def init_driver(
+# ========== 深度反检测配置 ==========
+STEALTH_INIT_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+    Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
+    Object.defineProperty(navigator, 'languages', {get: () => ['en-US', 'en']});
+    Object.defineProperty(navigator, 'hardwareConcurrency', {get: () => 8});
+    Object.defineProperty(navigator, 'deviceMemory', {get: () => 8});
+    Object.defineProperty(navigator, 'maxTouchPoints', {get: () => 2});
+    Object.defineProperty(navigator, 'vendor', {get: () => 'Google Inc.'});
+    Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
+
+    window.chrome = { runtime: {} };
+
+    Object.defineProperty(window, 'outerHeight', { get: () => window.innerHeight });
+    Object.defineProperty(window, 'outerWidth', { get: () => window.innerWidth });
+
+    const getParameter = WebGLRenderingContext.prototype.getParameter;
+    WebGLRenderingContext.prototype.getParameter = function(parameter) {
+        if (parameter === 37445) { return 'Intel Inc.'; }
+        if (parameter === 37446) { return 'Intel Iris OpenGL Engine'; }
+        return getParameter(parameter);
+    };
+
+    const originalQuery = window.navigator.permissions.query;
+    window.navigator.permissions.query = (parameters) =>
+        parameters.name === 'notifications'
+            ? Promise.resolve({ state: Notification.permission })
+            : originalQuery(parameters);
+
+    Object.defineProperty(screen, 'width', { get: () => 1920 });
+    Object.defineProperty(screen, 'height', { get: () => 1080 });
+"""
+
+
+async def launch_browser(
+    playwright,
     headless: bool = True,
     use_proxy: bool = False,
     proxy_server: str = "http://127.0.0.1:1080",
-    locale: str = "en-AU",
-    timezone: str = "Australia/Sydney",
 ):
-    playwright = await async_playwright().start()
-
-    user_agents = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/15.1 Safari/605.1.15",
-    ]
-    user_agent = random.choice(user_agents)
-
-    launch_args = {
-        "headless": headless,
-        "args": [
-            "--disable-blink-features=AutomationControlled",
-            "--disable-web-security",
-            "--disable-features=IsolateOrigins,site-per-process",
-            "--no-sandbox",
-            "--disable-setuid-sandbox",
-            "--disable-dev-shm-usage",
-            "--disable-gpu",
-            "--enable-webgl",
-            "--ignore-certificate-errors",
-            "--allow-running-insecure-content",
-            "--disable-popup-blocking",
-            "--disable-features=script-streaming",
-            "--disable-extensions",
-            "--mute-audio",
-            "--disable-background-networking",
-            "--disable-background-timer-throttling",
-            "--disable-backgrounding-occluded-windows",
-            "--disable-breakpad",
-            "--disable-client-side-phishing-detection",
-        ]
-    }
+    # 资源拦截全部在页面的 CDP session 里完成（见 resource_policy.py），不加浏览器启动参数：
+    # --blink-settings 会覆盖 Playwright headless 模式自己设置的 hover/pointer 模拟
+    launch_args = {"headless": headless, "args": list(LAUNCH_ARGS)}
     if use_proxy:
         launch_args["proxy"] = {"server": proxy_server}
+    return await playwright.chromium.launch(**launch_args)
 
-    browser = await playwright.chromium.launch(**launch_args)
 
-    context_args = {
-        "user_agent": user_agent,
-        "viewport": {"width": 1920, "height": 1080},
-        "locale": locale,
-        "timezone_id": timezone,
-        "permissions": [],
-    }
+async def new_context(browser, locale: str = "en-AU", timezone: str = "Australia/Sydney", storage_state_path=None):
+    """每个 context 有独立的 cookie/存储，user agent 按 context 随机选一个；有保存的状态文件时带上它。"""
+    return await browser.new_context(
+        user_agent=random.choice(USER_AGENTS),
+        viewport={"width": 1920, "height": 1080},
+        locale=locale,
+        timezone_id=timezone,
+        permissions=[],
+        storage_state=load_storage_state(storage_state_path),
+    )
 
-    context = await browser.new_context(**context_args)
+
+async def new_page(context, resource_policy=DEFAULT_POLICY):
     page = await context.new_page()
+    await page.add_init_script(STEALTH_INIT_SCRIPT)
 
-    # ========== 深度反检测配置 ==========
-    await page.add_init_script(
-        """
-        Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
-        Object.defineProperty(navigator, 'plugins', {get: () => [1, 2, 3, 4, 5]});
-        Object.defineProperty(navigator, 'languages', {get: () => ['en-US', 'en']});
-        Object.defineProperty(navigator, 'hardwareConcurrency', {get: () => 8});
-        Object.defineProperty(navigator, 'deviceMemory', {get: () => 8});
-        Object.defineProperty(navigator, 'maxTouchPoints', {get: () => 2});
-        Object.defineProperty(navigator, 'vendor', {get: () => 'Google Inc.'});
-        Object.defineProperty(navigator, 'platform', {get: () => 'Win32'});
-        
-        window.chrome = { runtime: {} };
-        
-        Object.defineProperty(window, 'outerHeight', { get: () => window.innerHeight });
-        Object.defineProperty(window, 'outerWidth', { get: () => window.innerWidth });
-
-        const getParameter = WebGLRenderingContext.prototype.getParameter;
-        WebGLRenderingContext.prototype.getParameter = function(parameter) {
-            if (parameter === 37445) { return 'Intel Inc.'; }
-            if (parameter === 37446) { return 'Intel Iris OpenGL Engine'; }
-            return getParameter(parameter);
-        };
-
-        const originalQuery = window.navigator.permissions.query;
-        window.navigator.permissions.query = (parameters) =>
-            parameters.name === 'notifications'
-                ? Promise.resolve({ state: Notification.permission })
-                : originalQuery(parameters);
-
-        Object.defineProperty(screen, 'width', { get: () => 1920 });
-        Object.defineProperty(screen, 'height', { get: () => 1080 });
-        """
-    )
+    # 资源拦截在浏览器内完成（CDP），放行的请求不再经过 Python 回调
+    if resource_policy is not None:
+        await apply_resource_policy(context, page, resource_policy)
 
-    # 图片请求拦截 + 网络请求反检测
-    await page.route("**/*", lambda route: (
-        route.abort()
-        if route.request.resource_type in ["image"]
-        else route.continue_()
-    ))
-    
     if USE_STEALTH:
         await stealth_async(page)
+    return page
+
+
+async def init_driver(
+    headless: bool = True,
+    use_proxy: bool = False,
+    proxy_server: str = "http://127.0.0.1:1080",
+    locale: str = "en-AU",
+    timezone: str = "Australia/Sydney",
+    resource_policy=DEFAULT_POLICY,
+    storage_state_path=None,
+):
+    """独立的 Playwright driver + 浏览器 + context + 页面；多个页面共用一个浏览器见 browser_host.py。
 
+    storage_state_path 见 storage_state.py：启动时加载，页面上的弹窗被关掉后刷新。
+    """
+    playwright = await async_playwright().start()
+    browser = await launch_browser(playwright, headless, use_proxy, proxy_server)
+    context = await new_context(browser, locale, timezone, storage_state_path)
+    page = await new_page(context, resource_policy)
+    track_page(page, storage_state_path)
     logging.info("Browser initialized with advanced stealth settings")
     return playwright, browser, context, page
@@ -0,0 +1,116 @@
+"""按 card_issue_country 路由到对应地区的查询页面。
+
+每个地区有自己的 URL、浏览器 locale/时区和一组选择器；页面池按地区分开预热。
+内置 AU 和 NZ，可以用 LULU_REGIONS_FILE 指向一个 JSON 文件增加或覆盖地区：
+
+    [{"code": "NZ", "url": "...", "locale": "en-NZ", "timezone": "Pacific/Auckland",
+      "aliases": ["NEW ZEALAND"], "selectors": {"check_another": "//button[...]"}}]
+"""
+import json
+import logging
+
+from settings import DEFAULT_REGION, ERROR_MESSAGE_SELECTOR, GIFT_CARD_URL, REGIONS_FILE
+
+# 请求里的 card_issue_country 没有对应的地区时，卡不会被送到任何页面
+UNSUPPORTED_REGION = "unsupported_region"
+
+
+class Selectors:
+    """一个地区页面上的元素位置。除 error_css 外都是 XPath（不带 xpath= 前缀，方便同时用于页面内的 JS）。"""
+
+    FIELDS = (
+        "popup_modal", "popup_close", "open_dialog", "card_input",
+        "check_button", "balance", "check_another", "error_css",
+    )
+
+    def __init__(self, **overrides):
+        self.popup_modal = '//*[@id="countrySelectorModal"]'
+        self.popup_close = '//*[@id="countrySelectorModal"]/div/div/div[1]/button'
+        self.open_dialog = "/html/body/div[1]/div[3]/div[2]/a"
+        self.card_input = '//*[@id="card-number"]'
+        self.check_button = '//button[@value="check-balance"]'
+        self.balance = '//p[@class="balance"]'
+        self.check_another = '//button[contains(text(), "CHECK ANOTHER CARD")]'
+        self.error_css = ERROR_MESSAGE_SELECTOR
+        for name, value in overrides.items():
+            if name not in self.FIELDS:
+                raise ValueError(f"Unknown selector '{name}'")
+            setattr(self, name, value)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+def xpath(selector):
+    return f"xpath={selector}"
+
+
+class Region:
+    def __init__(self, code, url, locale, timezone, selectors=None, aliases=()):
+        self.code = code.upper()
+        self.url = url
+        self.locale = locale
+        self.timezone = timezone
+        self.selectors = selectors or Selectors()
+        self.aliases = {alias.upper() for alias in aliases}
+
+    def __repr__(self):
+        return f"Region({self.code!r}, {self.url!r})"
+
+
+REGIONS = {}
+
+
+def register_region(region):
+    REGIONS[region.code] = region
+    return region
+
+
+def load_regions_file(path):
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    for entry in entries:
+        register_region(Region(
+            entry["code"],
+            entry["url"],
+            entry.get("locale", "en-US"),
+            entry.get("timezone", "UTC"),
+            selectors=Selectors(**entry.get("selectors", {})),
+            aliases=entry.get("aliases", ()),
+        ))
+    logging.info(f"Loaded {len(entries)} regions from {path}")
+
+
+def resolve_region(country):
+    """card_issue_country（AU、au、Australia 等）-> Region，认不出来时返回 None。"""
+    key = str(country or "").strip().upper()
+    if key in REGIONS:
+        return REGIONS[key]
+    for region in REGIONS.values():
+        if key in region.aliases:
+            return region
+    return None
+
+
+def get_region(code=None):
+    region = resolve_region(code or DEFAULT_REGION)
+    if region is None:
+        raise ValueError(f"Unknown region '{code or DEFAULT_REGION}', known regions: {sorted(REGIONS)}")
+    return region
+
+
+# ========== 内置地区 ==========
+# AU 的 URL 跟随 LULU_GIFT_CARD_URL，方便指向本地模拟站点
+register_region(Region("AU", GIFT_CARD_URL, "en-AU", "Australia/Sydney", aliases=["AUS", "AUSTRALIA"]))
+register_region(Region(
+    "NZ",
+    "https://www.lululemon.co.nz/en-nz/content/gift-cards/gift-cards.html",
+    "en-NZ",
+    "Pacific/Auckland",
+    aliases=["NZL", "NEW ZEALAND"],
+))
+if REGIONS_FILE:
+    load_regions_file(REGIONS_FILE)
+
+# 不指定地区的调用（process_card_batch、bench 脚本）使用默认地区的选择器
+DEFAULT_SELECTORS = get_region().selectors
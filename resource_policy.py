@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import weakref
+
+from settings import BLOCK_THIRD_PARTY_ANALYTICS, BLOCKED_RESOURCE_TYPES, EXTRA_BLOCKED_URL_PATTERNS, TRACK_PAGE_TRAFFIC
+
+# 配置里的资源类型 -> CDP Network.ResourceType。按浏览器判断的真实类型拦截，
+# images.lululemon.com/is/image/...?wid= 这种不带扩展名的图片也会被拦掉
+CDP_RESOURCE_TYPES = {
+    "image": "Image",
+    "font": "Font",
+    "media": "Media",
+    "stylesheet": "Stylesheet",
+}
+
+THIRD_PARTY_ANALYTICS_PATTERNS = [
+    "*googletagmanager.com*",
+    "*google-analytics.com*",
+    "*analytics.google.com*",
+    "*doubleclick.net*",
+    "*googleadservices.com*",
+    "*connect.facebook.net*",
+    "*facebook.com/tr*",
+    "*bat.bing.com*",
+    "*clarity.ms*",
+    "*hotjar.com*",
+    "*quantummetric.com*",
+    "*cdn.segment.com*",
+    "*api.segment.io*",
+    "*analytics.tiktok.com*",
+    "*ct.pinterest.com*",
+    "*snap.licdn.com*",
+    "*cdn.branch.io*",
+    "*tags.tiqcdn.com*",
+    "*assets.adobedtm.com*",
+    "*demdex.net*",
+    "*omtrdc.net*",
+]
+
+_page_traffic = weakref.WeakKeyDictionary()
+
+
+class ResourcePolicy:
+    """声明式的资源拦截规则：按资源类型（CDP Fetch）和 URL 通配符（CDP setBlockedURLs）；
+    track_traffic 时另外统计每个页面的流量。"""
+
+    def __init__(
+        self,
+        blocked_types=BLOCKED_RESOURCE_TYPES,
+        block_analytics=BLOCK_THIRD_PARTY_ANALYTICS,
+        extra_url_patterns=EXTRA_BLOCKED_URL_PATTERNS,
+        track_traffic=TRACK_PAGE_TRAFFIC,
+    ):
+        unknown = set(blocked_types) - set(CDP_RESOURCE_TYPES)
+        if unknown:
+            raise ValueError(f"Unknown resource types to block: {sorted(unknown)}")
+        self.blocked_types = list(blocked_types)
+        self.block_analytics = block_analytics
+        self.extra_url_patterns = list(extra_url_patterns)
+        self.track_traffic = track_traffic
+
+    def fetch_patterns(self):
+        """Fetch.enable 的 patterns：只有这些类型的请求会在浏览器里暂停并通知 Python。"""
+        return [
+            {"urlPattern": "*", "resourceType": CDP_RESOURCE_TYPES[resource_type], "requestStage": "Request"}
+            for resource_type in self.blocked_types
+        ]
+
+    def url_patterns(self):
+        patterns = []
+        if self.block_analytics:
+            patterns.extend(THIRD_PARTY_ANALYTICS_PATTERNS)
+        patterns.extend(self.extra_url_patterns)
+        return patterns
+
+
+class PageTraffic:
+    """单个页面的请求数和字节数统计，数据来自 CDP Network 事件。"""
+
+    def __init__(self):
+        self.requests = 0
+        self.finished = 0
+        self.failed = 0
+        self.blocked = 0
+        self.bytes = 0
+
+    def on_request(self, params):
+        self.requests += 1
+
+    def on_finished(self, params):
+        self.finished += 1
+        self.bytes += int(params.get("encodedDataLength", 0))
+
+    def on_failed(self, params):
+        # setBlockedURLs 拦下的请求带 blockedReason，Fetch.failRequest 拦下的是 ERR_BLOCKED_BY_CLIENT
+        if params.get("blockedReason") or "ERR_BLOCKED_BY_CLIENT" in params.get("errorText", ""):
+            self.blocked += 1
+        else:
+            self.failed += 1
+
+    def snapshot(self):
+        return {
+            "requests": self.requests,
+            "finished": self.finished,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "bytes": self.bytes,
+        }
+
+
+DEFAULT_POLICY = ResourcePolicy()
+
+
+def _fail_paused_request(session, params):
+    """Fetch 只暂停要拦截的类型的请求，这里直接让它失败；页面关闭后发送失败的错误忽略掉。"""
+    task = asyncio.ensure_future(
+        session.send("Fetch.failRequest", {"requestId": params["requestId"], "errorReason": "BlockedByClient"})
+    )
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+
+async def apply_resource_policy(context, page, policy=DEFAULT_POLICY):
+    """通过 CDP 在浏览器内拦截请求；policy.track_traffic 时订阅 Network 事件统计该页面的流量。
+
+    资源类型用 Fetch 拦截：只有要拦的请求会暂停并回到 Python，放行的请求不经过 Python；
+    分析脚本和额外的 URL 通配符用 setBlockedURLs，完全在浏览器里完成。
+    不统计、也没有要拦截的规则时连 CDP session 都不开。
+    """
+    fetch_patterns = policy.fetch_patterns()
+    patterns = policy.url_patterns()
+    if not fetch_patterns and not patterns and not policy.track_traffic:
+        return None
+    traffic = None
+    session = await context.new_cdp_session(page)
+    if policy.track_traffic:
+        traffic = PageTraffic()
+        session.on("Network.requestWillBeSent", traffic.on_request)
+        session.on("Network.loadingFinished", traffic.on_finished)
+        session.on("Network.loadingFailed", traffic.on_failed)
+        _page_traffic[page] = traffic
+    # setBlockedURLs 只在启用了 Network 的 session 上生效
+    await session.send("Network.enable")
+    if patterns:
+        await session.send("Network.setBlockedURLs", {"urls": patterns})
+    if fetch_patterns:
+        session.on("Fetch.requestPaused", lambda params: _fail_paused_request(session, params))
+        await session.send("Fetch.enable", {"patterns": fetch_patterns})
+    logging.info(
+        f"Resource policy applied: blocked types {policy.blocked_types}, {len(patterns)} blocked URL patterns, "
+        f"traffic tracking {policy.track_traffic}"
+    )
+    return traffic
+
+
+def get_page_traffic(page):
+    traffic = _page_traffic.get(page)
+    return traffic.snapshot() if traffic else None
@@ -0,0 +1,89 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+
+
+class AsyncRuntime:
+    """在单独线程上常驻的一个 asyncio 事件循环。
+
+    Playwright 对象绑定在创建它们的循环上，所以页面池、任务执行器和所有 HTTP 请求共用这个循环。
+    Flask 的处理函数（在 WSGI 线程上）用 submit/run 提交协程并等返回的 future，不自己建循环。
+    """
+
+    def __init__(self, name="playwright-loop"):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._shutdown_hooks = []
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return self
+        self.loop = asyncio.new_event_loop()
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        logging.info(f"Async runtime '{self.name}' started")
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def submit(self, coro):
+        """从任意线程提交协程，返回 concurrent.futures.Future。"""
+        if not self.running:
+            coro.close()
+            raise RuntimeError(f"Async runtime '{self.name}' is not running")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """提交协程并阻塞等待结果；超时后会取消协程并抛出 TimeoutError。"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def add_shutdown_hook(self, hook):
+        """注册一个在关闭事件循环之前执行的协程函数，例如关闭页面池。"""
+        self._shutdown_hooks.append(hook)
+
+    def stop(self, timeout=30):
+        if not self.running:
+            return
+        try:
+            self.run(self._shutdown(), timeout=timeout)
+        except Exception as e:
+            logging.error(f"Async runtime '{self.name}' did not shut down cleanly: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=timeout)
+        logging.info(f"Async runtime '{self.name}' stopped")
+
+    async def _shutdown(self):
+        for hook in reversed(self._shutdown_hooks):
+            try:
+                await hook()
+            except Exception as e:
+                logging.error(f"Shutdown hook {hook!r} failed: {e}")
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
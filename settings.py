@@ -0,0 +1,153 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# ========== 查询页面 ==========
+GIFT_CARD_URL = os.environ.get(
+    "LULU_GIFT_CARD_URL",
+    "https://www.lululemon.com.au/en-au/content/gift-cards/gift-cards.html",
+)
+HEADLESS = _env_bool("LULU_HEADLESS", False)
+
+# ========== 地区 ==========
+# card_issue_country 认不出来时不会查询；DEFAULT_REGION 是 bulk_check 和旧调用方的默认地区
+DEFAULT_REGION = os.environ.get("LULU_DEFAULT_REGION", "AU").upper()
+# 启动时就预热页面池的地区，其他地区第一次有卡时才启动
+WARM_REGIONS = [
+    value.strip().upper()
+    for value in os.environ.get("LULU_WARM_REGIONS", DEFAULT_REGION).split(",")
+    if value.strip()
+]
+# JSON 文件，增加地区或覆盖内置地区的 URL/locale/时区/选择器，格式见 regions.py
+REGIONS_FILE = os.environ.get("LULU_REGIONS_FILE") or None
+
+# ========== 页面池 ==========
+POOL_SIZE = _env_int("LULU_POOL_SIZE", 3)
+POOL_LEASE_TIMEOUT_S = _env_float("LULU_POOL_LEASE_TIMEOUT_S", 120.0)
+# 页面回收：查询次数、存活时间或 JS 堆内存超过阈值后，先在后台预热替换页面再关闭旧页面；0 表示不按这一项回收
+POOL_RECYCLE_CHECKS = _env_int("LULU_POOL_RECYCLE_CHECKS", 500)
+POOL_RECYCLE_AGE_S = _env_float("LULU_POOL_RECYCLE_AGE_S", 3600.0)
+POOL_RECYCLE_MEMORY_MB = _env_float("LULU_POOL_RECYCLE_MEMORY_MB", 256.0)
+POOL_MEMORY_CHECK_EVERY = _env_int("LULU_POOL_MEMORY_CHECK_EVERY", 20)  # 每查询这么多张卡通过 CDP 量一次内存
+# per_page: 每个页面一个独立的浏览器；shared: 每个进程一个浏览器，页面分布在多个 context 里
+BROWSER_TOPOLOGY = os.environ.get("LULU_BROWSER_TOPOLOGY", "per_page")
+PAGES_PER_CONTEXT = _env_int("LULU_PAGES_PER_CONTEXT", 1)
+# 关掉国家选择弹窗后的 cookie/localStorage 按地区保存在这里，新 context 直接加载，跳过弹窗
+STORAGE_STATE_ENABLED = _env_bool("LULU_STORAGE_STATE", True)
+STORAGE_STATE_DIR = os.environ.get(
+    "LULU_STORAGE_STATE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "storage_state"),
+)
+
+# ========== 余额缓存 ==========
+CACHE_TTL_S = _env_int("LULU_CACHE_TTL_S", 600)
+CACHE_MAX_ENTRIES = _env_int("LULU_CACHE_MAX_ENTRIES", 10000)
+CACHE_SQLITE_PATH = os.environ.get("LULU_CACHE_SQLITE_PATH") or None
+CACHE_SALT = os.environ.get("LULU_CACHE_SALT") or None
+# 落盘缓存多久清理一次过期的行
+CACHE_PURGE_INTERVAL_S = _env_int("LULU_CACHE_PURGE_INTERVAL_S", 600)
+
+# ========== 异步任务 ==========
+JOBS_DB_PATH = os.environ.get(
+    "LULU_JOBS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "jobs.sqlite3"),
+)
+JOB_MAX_CARDS = _env_int("LULU_JOB_MAX_CARDS", 10000)
+JOB_CHUNK_SIZE = _env_int("LULU_JOB_CHUNK_SIZE", 0)  # 0 = 每次取页面池大小的 4 倍
+JOB_POLL_INTERVAL_S = _env_float("LULU_JOB_POLL_INTERVAL_S", 5.0)
+
+# ========== 并发调节（AIMD） ==========
+# 同时在查询的卡数上限，在 [MIN, MAX] 之间自动调整；MAX 默认等于页面池大小
+CONCURRENCY_MIN = _env_int("LULU_CONCURRENCY_MIN", 1)
+CONCURRENCY_MAX = _env_int("LULU_CONCURRENCY_MAX", POOL_SIZE)
+CONCURRENCY_INITIAL = _env_int("LULU_CONCURRENCY_INITIAL", 0)  # 0 = 从 MAX 开始
+CONCURRENCY_WINDOW = _env_int("LULU_CONCURRENCY_WINDOW", 20)
+CONCURRENCY_ERROR_THRESHOLD = _env_float("LULU_CONCURRENCY_ERROR_THRESHOLD", 0.1)
+CONCURRENCY_DECREASE_FACTOR = _env_float("LULU_CONCURRENCY_DECREASE_FACTOR", 0.5)
+
+# ========== 多进程分片 ==========
+# 大于 0 时异步任务交给这么多个 worker 进程查询，每个进程有自己的页面池（LULU_SHARD_PAGES 个页面）
+SHARD_PROCESSES = _env_int("LULU_SHARD_PROCESSES", 0)
+SHARD_PAGES = _env_int("LULU_SHARD_PAGES", POOL_SIZE)
+
+# ========== 日志 ==========
+# 默认写到仓库上一级的 log 目录（和原来从仓库根目录启动时的 ../log 相同），不再依赖当前目录
+LOG_DIR = os.environ.get(
+    "LULU_LOG_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log")
+)
+LOG_LEVEL = os.environ.get("LULU_LOG_LEVEL", "INFO").upper()
+# 每张卡的 INFO / DEBUG 日志按比例整卡采样，WARNING 及以上始终保留
+LOG_SAMPLE_INFO = _env_float("LULU_LOG_SAMPLE_INFO", 1.0)
+LOG_SAMPLE_DEBUG = _env_float("LULU_LOG_SAMPLE_DEBUG", 0.1)
+LOG_MASK_CARDS = _env_bool("LULU_LOG_MASK_CARDS", True)
+
+# ========== HTTP ==========
+REQUEST_TIMEOUT_S = _env_float("LULU_REQUEST_TIMEOUT_S", 300.0)
+STREAM_MAX_ITEMS = _env_int("LULU_STREAM_MAX_ITEMS", 100)
+# 卡号去掉空白和分隔符后必须完整匹配，不匹配的卡返回 malformed_card，不送到浏览器
+CARD_NUMBER_PATTERN = os.environ.get("LULU_CARD_NUMBER_PATTERN", r"\d{16,24}")
+
+# ========== 余额读取方式 ==========
+# dom: 等待 p.balance 渲染后读取；response: 直接解析余额接口的响应，失败时回退到 dom；
+# inpage: 输入、查询、等结果、复位在一次 page.evaluate 里完成（页面里的合成点击，站点如果校验 isTrusted 就用 dom）
+CHECK_MODE = os.environ.get("LULU_CHECK_MODE", "dom")
+BALANCE_RESPONSE_PATTERN = os.environ.get(
+    "LULU_BALANCE_RESPONSE_PATTERN", r"gift-?card.*balance|balance.*gift-?card|checkbalance"
+)
+
+# ========== 资源拦截 ==========
+# 资源类型用 CDP Fetch 按浏览器判断的类型拦截，URL 通配符用 CDP Network.setBlockedURLs；放行的请求不会经过 Python
+BLOCKED_RESOURCE_TYPES = [
+    value.strip()
+    for value in os.environ.get("LULU_BLOCKED_RESOURCE_TYPES", "image,font,media").split(",")
+    if value.strip()
+]
+BLOCK_THIRD_PARTY_ANALYTICS = _env_bool("LULU_BLOCK_THIRD_PARTY_ANALYTICS", True)
+EXTRA_BLOCKED_URL_PATTERNS = [
+    value.strip()
+    for value in os.environ.get("LULU_EXTRA_BLOCKED_URL_PATTERNS", "").split(",")
+    if value.strip()
+]
+# 按页面统计请求数和字节数需要订阅每个请求的 CDP 事件，只在 benchmark 里打开
+TRACK_PAGE_TRAFFIC = _env_bool("LULU_TRACK_PAGE_TRAFFIC", False)
+
+# ========== 查询节奏 ==========
+# zero: 不等待（benchmark/测试）；human: 原来的随机等待和模拟人的动作；measured: 每个页面按固定速率匀速查询
+# 各策略的参数见 pacing.py，LULU_PACING_FILE 指向 JSON 文件可以增加或覆盖策略
+PACING_PROFILE_NAME = os.environ.get("LULU_PACING_PROFILE", "human")
+PACING_RATE_PER_MIN = _env_float("LULU_PACING_RATE_PER_MIN", 30.0)  # measured 策略每个页面每分钟查询的卡数
+PACING_FILE = os.environ.get("LULU_PACING_FILE") or None
+
+# ========== 失败分类与重试 ==========
+# 只有超时这类暂时性失败会重试，退避时间按 base * 2^(n-1) 增长并以 cap 封顶
+CHECK_MAX_ATTEMPTS = _env_int("LULU_CHECK_MAX_ATTEMPTS", 4)
+CHECK_RESULT_TIMEOUT_MS = _env_int("LULU_CHECK_RESULT_TIMEOUT_MS", 5000)
+RETRY_BACKOFF_BASE_S = _env_float("LULU_RETRY_BACKOFF_BASE_S", 0.5)
+RETRY_BACKOFF_CAP_S = _env_float("LULU_RETRY_BACKOFF_CAP_S", 8.0)
+ERROR_MESSAGE_SELECTOR = os.environ.get(
+    "LULU_ERROR_MESSAGE_SELECTOR", ".error, .invalid-feedback, .alert-danger, [role=alert]"
+)
+INVALID_CARD_PATTERN = os.environ.get(
+    "LULU_INVALID_CARD_PATTERN",
+    r"invalid|not found|not recogni[sz]ed|incorrect|unknown card|does not exist|check the (card )?number",
+)
+BLOCKED_PATTERN = os.environ.get(
+    "LULU_BLOCKED_PATTERN",
+    r"access denied|forbidden|too many requests|rate limit|captcha|unusual traffic|temporarily blocked",
+)
@@ -0,0 +1,289 @@
+"""多进程分片查询：协调进程把卡号分发给 N 个 worker 进程，每个 worker 有自己的 Playwright 和页面池。
+
+单进程时所有浏览器都挂在同一个 Playwright driver 连接和同一个事件循环上，CPU 核多了也用不上。
+worker 进程用 ``python -m sharding worker`` 独立启动（不 fork/spawn 调用方，避免把 app.py 的
+模块级初始化在子进程里再跑一遍），通过 multiprocessing.connection 和协调进程通信：
+
+    协调进程 -> worker: ("check", key, card_number) / ("stop",)
+    worker -> 协调进程: ("ready", worker_id, pid) / ("result", key, result, busy_s)
+
+协调进程持有共享队列，哪个 worker 有空闲页面就把下一张卡发给它；每个 worker 最多同时
+处理 pages 张卡，所以慢进程不会囤积卡号。
+"""
+import argparse
+import asyncio
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener, wait
+from pathlib import Path
+
+from card_processing import check_card_with_pool, failed_result
+from governor import GOVERNOR
+from log_config import setup_logging
+from page_pool import PagePool
+from regions import get_region
+from settings import HEADLESS, POOL_SIZE
+
+REPO_ROOT = Path(__file__).resolve().parent
+AUTHKEY_ENV = "LULU_SHARD_AUTHKEY"
+
+
+class ShardsStopped(RuntimeError):
+    """协调器已经关闭，正在进行的 map 被中断。"""
+
+
+class _Worker:
+    def __init__(self, worker_id, process, conn, pid):
+        self.worker_id = worker_id
+        self.process = process
+        self.conn = conn
+        self.pid = pid
+        self.alive = True
+        self.in_flight = {}
+        self.cards = 0
+        self.busy_s = 0.0
+        self.started_at = time.monotonic()
+
+
+class ShardCoordinator:
+    """启动 processes 个 worker 进程，每个进程 pages_per_process 个 region 地区的页面。"""
+
+    def __init__(self, processes, pages_per_process=POOL_SIZE, url=None, headless=HEADLESS,
+                 ready_timeout_s=120.0, region=None):
+        self.processes = processes
+        self.pages_per_process = pages_per_process
+        self.region = region or get_region()
+        self.url = url or self.region.url
+        self.headless = headless
+        self.ready_timeout_s = ready_timeout_s
+        self._workers = []
+        self._map_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def size(self):
+        return self.processes * self.pages_per_process
+
+    def start(self):
+        authkey = secrets.token_bytes(32)
+        env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+        with Listener(("127.0.0.1", 0), authkey=authkey) as listener:
+            host, port = listener.address
+            processes = [
+                subprocess.Popen(
+                    [
+                        sys.executable, "-m", "sharding", "worker",
+                        "--address", f"{host}:{port}",
+                        "--worker-id", str(worker_id),
+                        "--pages", str(self.pages_per_process),
+                        "--region", self.region.code,
+                        "--url", self.url,
+                    ] + (["--headless"] if self.headless else []),
+                    cwd=REPO_ROOT,
+                    env=env,
+                )
+                for worker_id in range(1, self.processes + 1)
+            ]
+            # Listener.accept 没有超时参数，worker 起不来时靠看门狗关闭 listener
+            watchdog = threading.Timer(self.ready_timeout_s, listener.close)
+            watchdog.start()
+            try:
+                for _ in processes:
+                    conn = listener.accept()
+                    _, worker_id, pid = conn.recv()
+                    self._workers.append(_Worker(worker_id, processes[worker_id - 1], conn, pid))
+            except OSError:
+                for process in processes:
+                    process.kill()
+                raise RuntimeError(f"Shard workers did not start within {self.ready_timeout_s}s")
+            finally:
+                watchdog.cancel()
+        self._workers.sort(key=lambda worker: worker.worker_id)
+        logging.info(
+            f"Started {self.processes} {self.region.code} shard processes with {self.pages_per_process} pages each "
+            f"(pids {[worker.pid for worker in self._workers]})"
+        )
+        return self
+
+    def _worker_died(self, worker, on_result):
+        if not worker.alive:
+            return
+        worker.alive = False
+        logging.error(f"Shard worker {worker.worker_id} (pid {worker.pid}) exited unexpectedly")
+        for key, card_number in worker.in_flight.items():
+            on_result(key, failed_result(card_number))
+        worker.in_flight.clear()
+
+    def map(self, items, on_result, cancel_event=None):
+        """把 (key, card_number) 分发给各个 worker，每完成一张就调用 on_result(key, result)。
+
+        items 可以是生成器，只会按 worker 的空闲容量往前读；阻塞直到全部完成，返回本次的分进程统计。
+        cancel_event 被设置后不再分发新卡，等已经发出去的卡回来后返回。
+        """
+        with self._map_lock:
+            items = iter(items)
+            exhausted = False
+            started = time.monotonic()
+            counts = {worker.worker_id: 0 for worker in self._workers}
+            while True:
+                if self._stopped.is_set():
+                    raise ShardsStopped("Shard coordinator is stopped")
+                cancelled = cancel_event is not None and cancel_event.is_set()
+                alive = [worker for worker in self._workers if worker.alive]
+                if not alive:
+                    raise RuntimeError("All shard workers have exited")
+                for worker in alive:
+                    while not exhausted and not cancelled and len(worker.in_flight) < self.pages_per_process:
+                        item = next(items, None)
+                        if item is None:
+                            exhausted = True
+                            break
+                        key, card_number = item
+                        try:
+                            worker.conn.send(("check", key, card_number))
+                        except OSError:
+                            worker.in_flight[key] = card_number
+                            self._worker_died(worker, on_result)
+                            break
+                        worker.in_flight[key] = card_number
+                if (exhausted or cancelled) and not any(worker.in_flight for worker in alive):
+                    break
+
+                by_conn = {worker.conn: worker for worker in self._workers if worker.alive}
+                for conn in wait(list(by_conn), timeout=1.0):
+                    worker = by_conn[conn]
+                    try:
+                        message = conn.recv()
+                    except (EOFError, OSError):
+                        self._worker_died(worker, on_result)
+                        continue
+                    _, key, result, busy_s = message
+                    worker.in_flight.pop(key, None)
+                    worker.cards += 1
+                    worker.busy_s += busy_s
+                    counts[worker.worker_id] += 1
+                    on_result(key, result)
+
+            wall_s = time.monotonic() - started
+            return self._throughput(counts, wall_s)
+
+    def _throughput(self, counts, wall_s):
+        return [
+            {
+                "worker_id": worker.worker_id,
+                "pid": worker.pid,
+                "alive": worker.alive,
+                "cards": counts.get(worker.worker_id, 0),
+                "cards_per_min": round(counts.get(worker.worker_id, 0) / wall_s * 60, 1) if wall_s else None,
+            }
+            for worker in self._workers
+        ]
+
+    def stats(self):
+        """从启动到现在每个进程的累计吞吐量，用来挑选合适的进程数。"""
+        now = time.monotonic()
+        return {
+            "region": self.region.code,
+            "processes": self.processes,
+            "pages_per_process": self.pages_per_process,
+            "workers": [
+                {
+                    "worker_id": worker.worker_id,
+                    "pid": worker.pid,
+                    "alive": worker.alive,
+                    "in_flight": len(worker.in_flight),
+                    "cards": worker.cards,
+                    "busy_s": round(worker.busy_s, 1),
+                    "cards_per_min": round(worker.cards / (now - worker.started_at) * 60, 1),
+                }
+                for worker in self._workers
+            ],
+        }
+
+    def stop(self, timeout=30):
+        self._stopped.set()
+        for worker in self._workers:
+            try:
+                worker.conn.send(("stop",))
+            except OSError:
+                pass
+        for worker in self._workers:
+            try:
+                worker.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                logging.warning(f"Shard worker {worker.worker_id} did not exit, killing it")
+                worker.process.kill()
+            worker.conn.close()
+        logging.info("Shard coordinator stopped")
+
+
+# ========== worker 进程 ==========
+async def _worker_main(conn, worker_id, pages, region, url, headless):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def read_messages():
+        # Connection.recv 是阻塞调用，放在单独的线程里，收到的消息交给事件循环
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                message = ("stop",)
+            # 附上收到的时间，结果里的 queue_wait 从这里算起
+            loop.call_soon_threadsafe(queue.put_nowait, message + (time.monotonic(),))
+            if message[0] == "stop":
+                return
+
+    async def consume(consumer_id):
+        while True:
+            message = await queue.get()
+            if message[0] == "stop":
+                # 让其他 consumer 也能看到 stop
+                queue.put_nowait(message)
+                return
+            _, key, card_number, received_at = message
+            started = time.monotonic()
+            result = await check_card_with_pool(
+                pool, card_number, f"Shard {worker_id} consumer {consumer_id}", queued_at=received_at
+            )
+            conn.send(("result", key, result, time.monotonic() - started))
+
+    pool = PagePool(size=pages, url=url, headless=headless, region=region)
+    # 每个 worker 进程有自己的 GOVERNOR，上限最多到本进程的页面数
+    GOVERNOR.set_bounds(max_limit=pages)
+    await pool.start()
+    conn.send(("ready", worker_id, os.getpid()))
+    threading.Thread(target=read_messages, name="shard-reader", daemon=True).start()
+    try:
+        await asyncio.gather(*(consume(consumer_id + 1) for consumer_id in range(pages)))
+    finally:
+        await pool.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shard worker process (started by ShardCoordinator).")
+    parser.add_argument("role", choices=["worker"])
+    parser.add_argument("--address", required=True)
+    parser.add_argument("--worker-id", type=int, required=True)
+    parser.add_argument("--pages", type=int, default=POOL_SIZE)
+    parser.add_argument("--region", default=None)
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--headless", action="store_true")
+    args = parser.parse_args(argv)
+    setup_logging("shard_worker")
+
+    host, port = args.address.rsplit(":", 1)
+    conn = Client((host, int(port)), authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+    try:
+        asyncio.run(_worker_main(conn, args.worker_id, args.pages, get_region(args.region), args.url, args.headless))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
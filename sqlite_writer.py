@@ -0,0 +1,61 @@
+"""SQLite 的单独写线程：调用方只把写操作放进队列，写线程攒一批在一个事务里提交。
+
+任务结果和余额缓存每查完一张卡都要写一次库；直接在 AsyncRuntime 的事件循环上写，
+每次连接、提交和 fsync 都会卡住所有正在查询的页面。和日志一样（见 log_config.py），
+磁盘 I/O 都交给后台线程。
+"""
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+
+
+class SqliteWriter:
+    def __init__(self, path, name="sqlite-writer", batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        # 退出前把队列里剩下的写完
+        atexit.register(self.close)
+
+    def submit(self, write):
+        """write(db) 在写线程里执行，和同一批的其他写操作在同一个事务里提交。"""
+        self._queue.put(write)
+
+    def execute(self, sql, params=()):
+        self.submit(lambda db: db.execute(sql, params))
+
+    def flush(self):
+        """阻塞到目前提交的写操作都落盘；在事件循环上调用时放到线程池里。"""
+        self._queue.join()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        while True:
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            writes = [write for write in batch if write is not None]
+            try:
+                with db:
+                    for write in writes:
+                        write(db)
+            except Exception as e:
+                logging.error(f"SQLite writer for {self.path} failed to commit {len(writes)} writes: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if batch[-1] is None:
+                db.close()
+                return
@@ -0,0 +1,66 @@
+"""保存关掉国家选择弹窗之后的 cookie/localStorage，新的 context 直接带上，页面打开时就不再弹窗。
+
+每个地区一个文件（<LULU_STORAGE_STATE_DIR>/<地区>.json）。init_driver / BrowserHost.new_page 创建
+context 时读取它；页面上又出现弹窗（文件不存在、cookie 过期或站点改版）并被 close_popup 关掉后，
+用这个页面的 context 重新保存一次，之后新开的 context 就用新的状态。
+"""
+import asyncio
+import json
+import logging
+import os
+
+from settings import STORAGE_STATE_DIR, STORAGE_STATE_ENABLED
+
+# page -> 这个页面对应的状态文件，close_popup 关掉弹窗后据此刷新
+_page_state_paths = {}
+
+
+def storage_state_path(region_code, state_dir=STORAGE_STATE_DIR):
+    """地区的状态文件路径；LULU_STORAGE_STATE=0 时返回 None。"""
+    if not STORAGE_STATE_ENABLED or not state_dir:
+        return None
+    return os.path.join(state_dir, f"{region_code}.json")
+
+
+def load_storage_state(path):
+    """读取状态文件给 browser.new_context(storage_state=...) 用；文件不存在或损坏时返回 None。"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable storage state {path}: {e}")
+        return None
+    if not isinstance(state, dict) or "cookies" not in state:
+        logging.warning(f"Ignoring malformed storage state {path}")
+        return None
+    return state
+
+
+def _write_state(path, state):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    # 多个页面或进程同时刷新时，读到的总是一个完整的文件
+    os.replace(tmp_path, path)
+
+
+def track_page(page, path):
+    if path:
+        _page_state_paths[page] = path
+        page.on("close", lambda _: _page_state_paths.pop(page, None))
+
+
+async def refresh_storage_state(page):
+    """页面上的弹窗刚被关掉：保存这个页面 context 的状态，覆盖旧文件。"""
+    path = _page_state_paths.get(page)
+    if path is None:
+        return
+    try:
+        state = await page.context.storage_state()
+        await asyncio.get_running_loop().run_in_executor(None, _write_state, path, state)
+        logging.info(f"Storage state saved to {path} ({len(state.get('cookies', []))} cookies)")
+    except Exception as e:
+        logging.warning(f"Failed to save storage state to {path}: {e}")
@@ -0,0 +1,95 @@
+"""HTTP 请求的校验和规整：检查字段和类型，规整卡号，同一请求里的重复卡只查一次。
+
+CheckPlan 记录每张要查询的卡对应哪些原始下标，结果按下标合并回原始顺序，
+非 Lululemon 的卡和格式不对的卡不会送到浏览器。
+"""
+import re
+
+from card_processing import LULU_CARD_TYPE, build_item_result
+from settings import CARD_NUMBER_PATTERN
+
+# 卡号去掉空白和分隔符后仍不符合 CARD_NUMBER_PATTERN，不查询
+MALFORMED_CARD = "malformed_card"
+
+REQUIRED_FIELDS = ["card_type", "card_number", "card_issue_country", "calling_time"]
+
+CARD_NUMBER_RE = re.compile(CARD_NUMBER_PATTERN)
+CARD_NUMBER_SEPARATORS_RE = re.compile(r"[\s\-_./]+")
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_card_items(input_data):
+    """返回错误信息，校验通过时返回 None。"""
+    if not isinstance(input_data, list):
+        return "Invalid data format. Expected a list of objects."
+    for index, item in enumerate(input_data):
+        if not isinstance(item, dict) or not all(key in item for key in REQUIRED_FIELDS):
+            return "Each object must contain 'card_type', 'card_number', 'card_issue_country', and 'calling_time' fields."
+        if not isinstance(item["card_type"], str):
+            return f"Item {index}: 'card_type' must be a string."
+        if not isinstance(item["card_number"], (str, int)) or isinstance(item["card_number"], bool):
+            return f"Item {index}: 'card_number' must be a string."
+        if not isinstance(item["card_issue_country"], str):
+            return f"Item {index}: 'card_issue_country' must be a string."
+        if not _is_number(item["calling_time"]):
+            return f"Item {index}: 'calling_time' must be a unix timestamp."
+    return None
+
+
+def normalize_card_number(card_number):
+    """去掉空白和 - _ . / 分隔符；规整后不是合法卡号时返回 None。"""
+    normalized = CARD_NUMBER_SEPARATORS_RE.sub("", str(card_number))
+    return normalized if CARD_NUMBER_RE.fullmatch(normalized) else None
+
+
+class CheckPlan:
+    """一个请求里需要真正查询的卡。
+
+    card_numbers / countries 是去重后送去查询的卡（按第一次出现的顺序），
+    targets[position] 是这张卡对应的所有原始下标。
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.card_numbers = []
+        self.countries = []
+        self.targets = []
+        self.rejected = {}
+        self.skipped = []
+        positions = {}
+        for index, item in enumerate(items):
+            if item["card_type"] != LULU_CARD_TYPE:
+                self.skipped.append(index)
+                continue
+            card_number = normalize_card_number(item["card_number"])
+            if card_number is None:
+                self.rejected[index] = MALFORMED_CARD
+                continue
+            country = item["card_issue_country"].strip().upper()
+            key = (card_number, country)
+            if key not in positions:
+                positions[key] = len(self.card_numbers)
+                self.card_numbers.append(card_number)
+                self.countries.append(country)
+                self.targets.append([])
+            self.targets[positions[key]].append(index)
+
+    @property
+    def pending_count(self):
+        """等待查询结果的原始条目数（重复的卡按条目计）。"""
+        return sum(len(indexes) for indexes in self.targets)
+
+    def immediate_results(self):
+        """不需要查询的条目：(原始下标, 输出)。"""
+        for index in self.skipped:
+            yield index, build_item_result(self.items[index], {})
+        for index, outcome in self.rejected.items():
+            yield index, build_item_result(self.items[index], {"outcome": outcome})
+
+    def expand(self, position, result):
+        """第 position 张卡的查询结果 -> 每个对应的原始条目：(原始下标, 输出)。"""
+        for index in self.targets[position]:
+            yield index, build_item_result(self.items[index], result)